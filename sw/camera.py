@@ -8,8 +8,9 @@ A sensor that uses OpenCV for capture
 import cv2
 import threading
 import numpy as np
+import logging as log
 
-from time import time
+from time import monotonic
 
 
 # Link to raspicam_cv implementation for mapping values
@@ -26,6 +27,8 @@ class OpenCVCameraSensor:
         y_offset_pixels=0,
         auto_exposure=True,
         exposure=50,  # int for manual (each 1 is 100µs of exposure)
+        pipelined=False,  # capture on a background thread into a frame ring
+        ring_size=3,
     ):
         self.device_id = device_id
         # self.width = width
@@ -42,6 +45,21 @@ class OpenCVCameraSensor:
         self.x_offset_pixels = x_offset_pixels
         self.y_offset_pixels = y_offset_pixels
 
+        # Pipelined capture state. The ring needs at least 3 slots so the
+        # capture thread always has a slot that is neither the newest frame
+        # nor the frame the caller is still working on.
+        self.pipelined = pipelined
+        self.ring_size = max(3, ring_size)
+        self.ring = None
+        self.ring_timestamps = None
+        self.latest_slot = -1  # Slot holding the newest complete frame
+        self.reading_slot = -1  # Slot last handed out by __call__
+        self.frame_timestamp = 0.0  # Capture time of the last returned frame
+        self.thread = None
+        self.running = False
+        self.new_frame = threading.Condition()
+        self.failed_reads = 0  # By the capture thread
+
     def start(self):
         self.source = cv2.VideoCapture(self.device_id)
         if self.source:
@@ -58,39 +76,124 @@ class OpenCVCameraSensor:
         else:
             raise Exception("Couldn't create camera.")
 
+        if self.pipelined:
+            self.ring = np.zeros((self.ring_size, 288, 384, 3), dtype=np.uint8)
+            self.ring_timestamps = np.zeros(self.ring_size, dtype=np.float64)
+            self.latest_slot = -1
+            self.reading_slot = -1
+            self.running = True
+            self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+            self.thread.start()
+
     def stop(self):
+        if self.thread is not None:
+            with self.new_frame:
+                self.running = False
+                self.new_frame.notify_all()
+            self.thread.join(timeout=1.0)
+            self.thread = None
         if self.source:
             self.source.release()
             self.source = None
 
+    def _next_free_slot(self):
+        for slot in range(self.ring_size):
+            if slot != self.latest_slot and slot != self.reading_slot:
+                return slot
+
+    def _capture_loop(self):
+        """Grab frames into the ring until stopped (runs on its own thread)."""
+        failures = 0  # In a row
+        while self.running:
+            with self.new_frame:
+                slot = self._next_free_slot()
+
+            # Read straight into the preallocated slot, no per-frame allocation
+            buffer = self.ring[slot]
+            ret, frame = self.source.read(buffer)
+            timestamp = monotonic()
+            if not ret:
+                # Camera unplugged or shutting down: back off (up to a second,
+                # waking up for stop()) instead of spinning on read()
+                failures += 1
+                self.failed_reads += 1
+                if failures == 1:
+                    log.warning("Camera read failed, retrying")
+                backoff = min(2 ** failures / self.frequency, 1.0)
+                with self.new_frame:
+                    self.new_frame.wait_for(lambda: not self.running, backoff)
+                continue
+            if failures:
+                log.info(f"Camera read recovered after {failures} failures")
+                failures = 0
+            if frame is not buffer:
+                buffer[...] = frame
+
+            with self.new_frame:
+                self.ring_timestamps[slot] = timestamp
+                self.latest_slot = slot
+                self.new_frame.notify_all()
+
+    def _crop(self, frame):
+        w, h = 384, 288
+        d = 256  # Our final "destination" rectangle is 256x256
+
+        # Ensure the offset crops are possible
+        x_offset_pixels = min(self.x_offset_pixels, (w / 2 - d / 2))
+        x_offset_pixels = max(self.x_offset_pixels, -(w / 2 - d / 2))
+        y_offset_pixels = min(self.y_offset_pixels, (h / 2 - d / 2))
+        y_offset_pixels = max(self.y_offset_pixels, -(h / 2 - d / 2))
+
+        # Calculate the starting point in x & y
+        x = int((w / 2 - d / 2) + x_offset_pixels)
+        y = int((h / 2 - d / 2) + y_offset_pixels)
+
+        return frame[y : y + d, x : x + d]
+
+    def _newest_frame(self, timeout=1.0):
+        """
+        Wait for a frame newer than the last one returned and check it out.
+        The returned slot will not be overwritten until the next call.
+        """
+        with self.new_frame:
+            got_frame = self.new_frame.wait_for(
+                lambda: not self.running
+                or (
+                    self.latest_slot >= 0
+                    and self.ring_timestamps[self.latest_slot] > self.frame_timestamp
+                ),
+                timeout=timeout,
+            )
+            if not got_frame or not self.running:
+                raise ValueError("Could not get the next frame")
+
+            self.reading_slot = self.latest_slot
+            return self.ring[self.reading_slot], self.ring_timestamps[self.reading_slot]
+
     def __call__(self):
         # safety check
         if self.source is None:
             raise Exception("Using camera before it has been started.")
 
+        if self.pipelined:
+            # The frame was captured while the caller was busy with the
+            # previous one, so elapsed time is measured between captures
+            frame, timestamp = self._newest_frame()
+            elapsed_time = timestamp - self.frame_timestamp
+            self.frame_timestamp = timestamp
+            self.prev_time = timestamp
+            return self._crop(frame), elapsed_time
+
         # Calculate the time elapsed since the last sensor snapshot
-        curr_time = time()
+        curr_time = monotonic()
         elapsed_time = curr_time - self.prev_time
         self.prev_time = curr_time
 
         ret, frame = self.source.read()
         if ret:
-            w, h = 384, 288
-            d = 256  # Our final "destination" rectangle is 256x256
-
-            # Ensure the offset crops are possible
-            x_offset_pixels = min(self.x_offset_pixels, (w / 2 - d / 2))
-            x_offset_pixels = max(self.x_offset_pixels, -(w / 2 - d / 2))
-            y_offset_pixels = min(self.y_offset_pixels, (h / 2 - d / 2))
-            y_offset_pixels = max(self.y_offset_pixels, -(h / 2 - d / 2))
-
-            # Calculate the starting point in x & y
-            x = int((w / 2 - d / 2) + x_offset_pixels)
-            y = int((h / 2 - d / 2) + y_offset_pixels)
-
-            frame = frame[y : y + d, x : x + d]
+            self.frame_timestamp = monotonic()
             # frame = frame[:-24, 40:-80]  # Crop so middle of plate is middle of image
             # cv2.resize(frame, (256, 256))  # Crop off edges to make image (256, 256)
-            return frame, elapsed_time
+            return self._crop(frame), elapsed_time
         else:
             raise ValueError("Could not get the next frame")
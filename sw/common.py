@@ -2,6 +2,7 @@
 # Licensed under the MIT License.
 
 import math
+import numpy as np
 from dataclasses import dataclass
 
 
@@ -44,6 +45,109 @@ def derivative(frequency, fc=None):
     return derivate
 
 
+# Estimators -------------------------------------------------------------------
+# An estimator turns the detector's ball position into the state the controllers
+# see. MoabEnv builds one with `estimator_fn(frequency)` (and again on every
+# reset) and calls it each step as `estimate(x, y, ball_detected, dt)`, with dt
+# the seconds since the previous camera frame. It returns (x, y, vel_x, vel_y).
+def derivative_estimator(frequency, derivative_fn=derivative):
+    """
+    The measured position, with a velocity from `derivative_fn` (by default a
+    backward difference at the nominal frequency). Ignores dt and detections.
+    """
+    vel_x = derivative_fn(frequency)
+    vel_y = derivative_fn(frequency)
+
+    def estimate(x, y, ball_detected, dt):
+        return x, y, vel_x(x), vel_y(y)
+
+    return estimate
+
+
+class KalmanEstimator:
+    """
+    A constant acceleration Kalman filter of the ball on the plate, x and y
+    each with a position, velocity & acceleration.
+
+    Each step predicts forward by the actual dt, so late or dropped frames
+    don't show up as velocity spikes, then corrects with the detected
+    position. Missed detections are predicted through for up to `max_coast`
+    seconds, after which the track is dropped and the next detection starts
+    a new one.
+
+    Both axes share the same model and measurements, so they share one 3x3
+    covariance (of position, velocity & acceleration), see `covariance`.
+    """
+
+    def __init__(
+        self,
+        frequency,
+        jerk_noise=10.0,  # Process noise, (m/s^3)^2 per Hz
+        measurement_noise=0.002,  # Std dev of the detected position, meters
+        max_coast=0.25,  # Seconds to predict through missed detections
+    ):
+        self.frequency = frequency
+        self.jerk_noise = jerk_noise
+        self.measurement_variance = measurement_noise ** 2
+        self.max_coast = max_coast
+
+        self.state = np.zeros((3, 2))  # Rows: position, velocity & acceleration
+        self.covariance = np.zeros((3, 3))
+        self.tracking = False
+        self.coasted = 0.0
+
+    def predict(self, dt):
+        t2, t3 = dt * dt / 2, dt * dt * dt / 6
+        F = np.array([[1.0, dt, t2], [0.0, 1.0, dt], [0.0, 0.0, 1.0]])
+        # Integrated white noise jerk over dt
+        Q = self.jerk_noise * np.array(
+            [
+                [dt ** 5 / 20, dt ** 4 / 8, t3],
+                [dt ** 4 / 8, dt ** 3 / 3, t2],
+                [t3, t2, dt],
+            ]
+        )
+        self.state = F @ self.state
+        self.covariance = F @ self.covariance @ F.T + Q
+
+    def update(self, x, y):
+        # Only the position is measured, so H = [1, 0, 0]
+        P = self.covariance
+        gain = P[:, 0] / (P[0, 0] + self.measurement_variance)
+        self.state += np.outer(gain, (x - self.state[0, 0], y - self.state[0, 1]))
+        self.covariance = P - np.outer(gain, P[0])
+
+    def start_track(self, x, y):
+        self.state[:] = 0.0
+        self.state[0] = (x, y)
+        # Unknown velocity & acceleration: within a few m/s and m/s^2
+        self.covariance = np.diag((self.measurement_variance, 1.0, 10.0))
+        self.tracking = True
+        self.coasted = 0.0
+
+    def __call__(self, x, y, ball_detected, dt):
+        if dt <= 0:
+            dt = 1 / self.frequency
+        elif dt > self.max_coast:
+            self.tracking = False  # Too long since the last frame to predict
+
+        if self.tracking:
+            self.predict(dt)
+            if ball_detected:
+                self.update(x, y)
+                self.coasted = 0.0
+            else:
+                self.coasted += dt
+                self.tracking = self.coasted <= self.max_coast
+        elif ball_detected:
+            self.start_track(x, y)
+
+        if not self.tracking:
+            return x, y, 0.0, 0.0
+        (x, y), (vel_x, vel_y) = self.state[0], self.state[1]
+        return float(x), float(y), float(vel_x), float(vel_y)
+
+
 class Vector2:
     def __init__(self, x: float, y: float):
         self.x = float(x)
@@ -2,14 +2,19 @@
 # Licensed under the MIT License.
 
 import sys
+import json
 import time
-import requests
+import threading
+import http.client
 import numpy as np
 import logging as log
 
 from enum import IntEnum
 from env import MoabEnv
 from common import Vector2
+from docker import UnixHTTPConnection
+from policy import load_policy
+from profiler import LatencyProfiler
 
 
 class BrainNotFound(Exception):
@@ -74,11 +79,110 @@ def zero_controller(**kwargs):
     return next_action
 
 
+def brain_action(pitch, roll, max_angle=22):
+    """The plate action for a brain's input_pitch & input_roll (in [-1, 1])."""
+    # Scale and clip
+    pitch = min(max(pitch * max_angle, -max_angle), max_angle)
+    roll = min(max(roll * max_angle, -max_angle), max_angle)
+
+    # To match how the old brain works (only integer plate angles)
+    pitch, roll = int(pitch), int(roll)
+    return Vector2(-roll, pitch)
+
+
+def policy_controller(policy_file, max_angle=22, **kwargs):
+    """
+    Runs a brain's exported policy (see policy.py) in this process, instead
+    of asking a brain container over HTTP, with the same actions.
+    """
+    policy = load_policy(policy_file)
+    observation = np.zeros(4)
+
+    def next_action(state):
+        env_state, ball_detected, buttons = state
+        x, y, vel_x, vel_y, sum_x, sum_y = env_state
+
+        action = Vector2(0, 0)  # Action is 0,0 if not detected
+        info = {}
+        if ball_detected:
+            observation[:] = x, y, vel_x, vel_y
+            pitch, roll = policy(observation)
+            action = brain_action(pitch, roll, max_angle)
+            info = {"resp": {"input_pitch": float(pitch), "input_roll": float(roll)}}
+        return action, info
+
+    return next_action
+
+
+# Brain transports -------------------------------------------------------------
+# A transport sends one request to a brain, `transport(method, path, body)`, and
+# returns the status code and the decoded json reply (None if empty, not json or
+# `decode=False`). It raises BrainNotFound if no brain is listening.
+class HttpTransport:
+    """
+    HTTP to a brain on localhost:port. The connection is kept open between
+    predictions instead of set up for each one, and each request goes out in a
+    single write.
+    """
+
+    def __init__(self, port=5555, timeout=0.5):
+        self.address = f"localhost:{port}"
+        self.connection = http.client.HTTPConnection("localhost", port, timeout=timeout)
+
+    def __call__(self, method, path, body=None, decode=True):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+        # A kept-open connection may have been closed by the brain since the
+        # last request, if so retry once on a new one
+        for retry in (True, False):
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                self.connection.close()
+                raise BrainNotFound(self.address)
+            except ConnectionError:  # ie RemoteDisconnected, BrokenPipeError
+                self.connection.close()
+                if not retry:
+                    raise
+            except Exception:
+                self.connection.close()
+                raise
+
+        if not (decode and data):
+            return response.status, None
+        try:
+            return response.status, json.loads(data)
+        except ValueError:  # ie an error page
+            return response.status, None
+
+    def close(self):
+        self.connection.close()
+
+
+class UnixSocketTransport(HttpTransport):
+    """
+    The same HTTP requests over a unix domain socket, for a brain served on
+    one (ie with `uvicorn --uds`), which skips the TCP stack.
+    """
+
+    def __init__(self, socket_path, timeout=0.5):
+        self.address = socket_path
+        self.connection = UnixHTTPConnection(socket_path, timeout)
+
+
 def brain_controller(
     max_angle=22,
     port=5555,
     client_id=123,
     alert_fn=None,
+    transport=None,  # Defaults to an HttpTransport to localhost:port
+    timeout=0.5,  # Seconds to wait for the brain
     **kwargs,
 ):
     """
@@ -92,18 +196,35 @@ def brain_controller(
     creation of a brain controller we still call DELETE on the v2 brain
     endpoint. This way we don't need to know information about what the trained
     brain was called to navigate the json response.
+
+    The info returned with each action has the status and response of the
+    request and its latency in ms. The rolling p50/p95/p99 of that latency are
+    logged every 10 seconds, and the controller's `latency` (a LatencyProfiler)
+    has them on request.
     """
-    # Reset memory if a v2 brain
-    status = requests.delete(f"http://localhost:{port}/v2/clients/{client_id}")
-    version = 2 if status.status_code == 204 else 1
+    if transport is None:
+        transport = HttpTransport(port, timeout=timeout)
+    latency = LatencyProfiler()
+
+    # Reset memory if a v2 brain, a v1 brain answers with an error page
+    status, _ = transport("DELETE", f"/v2/clients/{client_id}", decode=False)
+    version = 2 if status == 204 else 1
 
     if version == 1:
-        prediction_url = f"http://localhost:{port}/v1/prediction"
+        prediction_path = "/v1/prediction"
     elif version == 2:
-        prediction_url = f"http://localhost:{port}/v2/clients/{client_id}/predict"
+        prediction_path = f"/v2/clients/{client_id}/predict"
     else:
         raise ValueError("Brain version `{self.version}` is not supported.")
 
+    def predict(method, observables):
+        start = time.perf_counter_ns()
+        status, resp = transport(method, prediction_path, observables)
+        elapsed_ns = time.perf_counter_ns() - start
+        latency.record("predict", elapsed_ns)
+        latency.maybe_log()
+        return {"status": status, "resp": resp, "latency_ms": elapsed_ns / 1e6}
+
     def next_action_v1(state):
         env_state, ball_detected, buttons = state
         x, y, vel_x, vel_y, sum_x, sum_y = env_state
@@ -124,24 +245,16 @@ def brain_controller(
             # when it loses the connection.
             try:
                 # Get action from brain
-                response = requests.get(prediction_url, json=observables)
-                info = {"status": response.status_code, "resp": response.json()}
+                info = predict("GET", observables)
 
-                if response.ok:
+                if 200 <= info["status"] < 400:
                     pitch = info["resp"]["input_pitch"]
                     roll = info["resp"]["input_roll"]
+                    action = brain_action(pitch, roll, max_angle)
 
-                    # Scale and clip
-                    pitch = np.clip(pitch * max_angle, -max_angle, max_angle)
-                    roll = np.clip(roll * max_angle, -max_angle, max_angle)
-
-                    # To match how the old brain works (only integer plate angles)
-                    pitch, roll = int(pitch), int(roll)
-                    action = Vector2(-roll, pitch)
-
-            except requests.exceptions.ConnectionError as e:
+            except BrainNotFound as e:
                 print(f"No brain listening on port: {port}", file=sys.stderr)
-                raise BrainNotFound
+                raise
             except Exception as e:
                 print(f"Brain exception: {e}")
         return action, info
@@ -168,36 +281,134 @@ def brain_controller(
             # when it loses the connection.
             try:
                 # Get action from brain
-                response = requests.post(prediction_url, json=observables)
-                info = {"status": response.status_code, "resp": response.json()}
+                info = predict("POST", observables)
 
-                if response.ok:
+                if 200 <= info["status"] < 400:
                     concepts = info["resp"]["concepts"]
                     concept_name = list(concepts.keys())[0]  # Just use first concept
                     pitch = concepts[concept_name]["action"]["input_pitch"]
                     roll = concepts[concept_name]["action"]["input_roll"]
+                    action = brain_action(pitch, roll, max_angle)
 
-                    # Scale and clip
-                    pitch = np.clip(pitch * max_angle, -max_angle, max_angle)
-                    roll = np.clip(roll * max_angle, -max_angle, max_angle)
-
-                    # To match how the old brain works (only integer plate angles)
-                    pitch, roll = int(pitch), int(roll)
-                    action = Vector2(-roll, pitch)
-
-            except requests.exceptions.ConnectionError as e:
+            except BrainNotFound as e:
                 print(f"No brain listening on port: {port}", file=sys.stderr)
-                raise BrainNotFound
+                raise
             except Exception as e:
                 print(f"Brain exception: {e}")
         return action, info
 
-    if version == 1:
-        return next_action_v1
-    elif version == 2:
-        return next_action_v2
-    else:
-        raise ValueError("Brain version `{self.version}` is not supported.")
+    next_action = next_action_v1 if version == 1 else next_action_v2
+    next_action.latency = latency
+    return next_action
+
+
+def async_decorator(
+    controller_fn,
+    max_staleness=0.2,  # Seconds, 6 frames at 30 Hz
+    fallback_fn=None,  # Defaults to a level plate
+    deadline=0.0,  # Seconds to wait for the action of the current state
+    idle_timeout=1.0,
+):
+    """
+    Runs a slow controller (ie a brain) on a worker thread so it doesn't hold
+    up the control loop. Each call hands the worker the newest state (a state
+    the worker hasn't started on yet is dropped) and returns the most recent
+    action the worker has finished, so the loop keeps its rate whatever the
+    controller's latency.
+
+    An action computed from a state more than `max_staleness` seconds old is
+    not used, fallback_fn's action for the current state is returned instead.
+    With a `deadline`, waits up to that long for the current state's action
+    before settling for an older one.
+
+    The info of the action gets `staleness_ms` (the age of the state it was
+    computed from) and `fallback`. Exceptions in controller_fn (ie
+    BrainNotFound) are raised again by the next call. The worker stops after
+    `idle_timeout` seconds without a state and is restarted on the next call.
+    """
+    fallback_fn = fallback_fn or zero_controller()
+    new_state = threading.Condition()
+    pending = None  # (tick, time submitted, state) for the worker
+    result = None  # (tick, time submitted, action, info) last finished
+    error = None
+    running = False
+    tick = 0
+
+    def work():
+        nonlocal pending, result, error, running
+        while True:
+            with new_state:
+                if not new_state.wait_for(lambda: pending, timeout=idle_timeout):
+                    running = False
+                    return
+                job, pending = pending, None
+
+            job_tick, submitted, state = job
+            try:
+                action, info = controller_fn(state)
+            except Exception as e:
+                with new_state:
+                    error, running = e, False
+                    new_state.notify_all()
+                return
+
+            with new_state:
+                result = (job_tick, submitted, action, info)
+                new_state.notify_all()
+
+    def next_action(state):
+        nonlocal pending, error, running, tick
+        with new_state:
+            if error is not None:
+                e, error = error, None
+                raise e
+
+            tick += 1
+            pending = (tick, time.monotonic(), state)
+            if not running:
+                running = True
+                threading.Thread(target=work, daemon=True).start()
+            new_state.notify_all()
+
+            if deadline > 0:
+                new_state.wait_for(
+                    lambda: (result and result[0] == tick) or error, timeout=deadline
+                )
+            latest = result
+
+        if latest is not None:
+            _, submitted, action, info = latest
+            staleness = time.monotonic() - submitted
+            if staleness <= max_staleness:
+                info = {**info, "staleness_ms": staleness * 1e3, "fallback": False}
+                return action, info
+
+        action, info = fallback_fn(state)
+        return action, {**info, "fallback": True}
+
+    return next_action
+
+
+def async_brain_controller(max_staleness=0.2, fallback="level", deadline=0.0, **kwargs):
+    """
+    A brain_controller run with async_decorator. `fallback` is the action
+    when the brain falls behind: "level" (the plate) or "pid".
+
+    A brain that takes longer than a frame hands back an action every other
+    frame or so, which is up to three frames old by the time the next one
+    arrives; the default max_staleness leaves room for that and only falls
+    back when the brain stalls.
+    """
+    fallbacks = {"level": zero_controller, "pid": pid_controller}
+    if fallback not in fallbacks:
+        raise ValueError(f"Unknown brain fallback {fallback!r}")
+
+    return async_decorator(
+        brain_controller(**kwargs),
+        max_staleness=max_staleness,
+        fallback_fn=fallbacks[fallback](**kwargs),
+        deadline=deadline,
+    )
 
 
 def kiosk_mode_decorator(
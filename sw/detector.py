@@ -9,7 +9,7 @@ import cv2
 import math
 import numpy as np
 from hsv import hue_to_bgr
-from huemask import hue_mask
+from huemask import hue_mask_gray
 from common import Vector2, CircleFeature, Calibration
 
 from typing import List, Optional
@@ -63,6 +63,30 @@ def save_img(filepath, img, rotated=False, quality=80):
     )
 
 
+def soft_centroid(soft_mask, contour, margin=3):
+    """
+    Sub-pixel center of a blob: the centroid of the unthresholded hue mask over
+    the filled contour grown by `margin` pixels, so the soft edge of the ball
+    (where the sub-pixel position shows) is weighed in too. Returns None if
+    there's no mask there.
+    """
+    height, width = soft_mask.shape[:2]
+    x, y, w, h = cv2.boundingRect(contour)
+    x0, y0 = max(x - margin, 0), max(y - margin, 0)
+    x1, y1 = min(x + w + margin, width), min(y + h + margin, height)
+
+    # Only the blob itself, not other hue-alike pixels near it
+    gate = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.drawContours(gate, [contour], -1, 255, -1, offset=(-x0, -y0))
+    grow = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * margin + 1,) * 2)
+    gate = cv2.dilate(gate, grow)
+
+    m = cv2.moments(cv2.bitwise_and(soft_mask[y0:y1, x0:x1], gate))
+    if m["m00"] == 0:
+        return None
+    return m["m10"] / m["m00"] + x0, m["m01"] / m["m00"] + y0
+
+
 def hsv_detector(
     calibration=None,
     frame_size=256,
@@ -71,6 +95,11 @@ def hsv_detector(
     ball_max=0.22,
     hue=None,  # hue [0..255]
     debug=False,
+    tracking=False,  # Only search a window around the predicted ball position
+    roi_margin=24,  # Pixels added around the ball radius for the window
+    max_misses=3,  # Consecutive misses before going back to a full frame search
+    publisher=None,  # FramePublisher for the debug stream (None saves inline)
+    localization="circle",  # Ball center: "circle" (enclosing) or "moments"
 ):
     if calibration is None:
         calibration = Calibration()
@@ -78,22 +107,100 @@ def hsv_detector(
     if hue is None:
         hue = calibration.ball_hue
     kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, tuple(kernel_size))
+    if localization not in ("circle", "moments"):
+        raise ValueError(f"Unknown ball localization {localization!r}")
+    moments = localization == "moments"
+
+    # Tracking state (in pixels). last_center is None when there is no track
+    # and the next frame has to be searched in full.
+    last_center = None
+    last_velocity = (0.0, 0.0)
+    last_radius = 0.0
+    misses = 0
+    track_hue = hue  # A track only holds for the hue it was found with
+
+    def reset_track():
+        nonlocal last_center, last_velocity, misses
+        last_center = None
+        last_velocity = (0.0, 0.0)
+        misses = 0
+
+    def tracking_window(height, width):
+        # Predict where the ball will be from the last center and velocity
+        x_pred = last_center[0] + last_velocity[0]
+        y_pred = last_center[1] + last_velocity[1]
+        half = int(last_radius + roi_margin + max(map(abs, last_velocity)))
+
+        x0 = int(min(max(x_pred - half, 0), width))
+        y0 = int(min(max(y_pred - half, 0), height))
+        x1 = int(min(max(x_pred + half, 0), width))
+        y1 = int(min(max(y_pred + half, 0), height))
+        return x0, y0, x1, y1
+
+    def update_track(ball_detected, x_obs=0.0, y_obs=0.0, radius=0.0):
+        nonlocal last_center, last_velocity, last_radius, misses
+
+        if ball_detected:
+            if last_center is not None:
+                last_velocity = (x_obs - last_center[0], y_obs - last_center[1])
+            last_center = (x_obs, y_obs)
+            last_radius = radius
+            misses = 0
+
+        elif last_center is not None:
+            misses += 1
+            if misses >= max_misses:
+                # Lost the ball, search the full frame again
+                reset_track()
+            else:
+                # Coast along the last velocity until it's found again
+                last_center = (
+                    last_center[0] + last_velocity[0],
+                    last_center[1] + last_velocity[1],
+                )
+
+    def save_frame(img, filename):
+        # Stream frames go through the publisher so encoding and disk writes
+        # happen off the control thread. Explicit filenames (like calibration
+        # snapshots) are one-offs that must not be dropped, so save inline.
+        if filename is None and publisher is not None:
+            publisher.publish(img)
+        else:
+            save_img(filename or "/tmp/camera/frame.jpg", img, quality=80)
+
+    def detect_features(img, hue=hue, debug=debug, filename=None):
+        nonlocal track_hue
+        # A different hue (ie a calibration sweep) finds a different blob
+        if hue != track_hue:
+            reset_track()
+            track_hue = hue
+
+        # Restrict the search to a window around the predicted position
+        height, width = img.shape[:2]
+        x0, y0, x1, y1 = 0, 0, width, height
+        if tracking and last_center is not None:
+            window = tracking_window(height, width)
+            # A window clipped down to less than a ball means the prediction
+            # has left the frame, so search everything instead
+            min_size = 2 * ball_min * frame_size
+            if window[2] - window[0] > min_size and window[3] - window[1] > min_size:
+                x0, y0, x1, y1 = window
 
-    def detect_features(img, hue=hue, debug=debug, filename="/tmp/camera/frame.jpg"):
         # covert to HSV space
-        img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        img_hsv = cv2.cvtColor(img[y0:y1, x0:x1], cv2.COLOR_BGR2HSV)
 
         # The hue_mask function follows CV2 convention and hue is in the range
         # [0, 180] instead of [0, 360]
         # run through each triplet and perform our masking filter on it.
-        # hue_mask coverts the hsv image into a grayscale image with a
-        # bandpass applied centered around hue, with width sigma
-        hue_mask(img_hsv, hue / 2, 0.03, 60.0, 1.5)
-
-        # convert to b&w mask from grayscale image
-        mask = cv2.inRange(
-            img_hsv, np.array((200, 200, 200)), np.array((255, 255, 255))
-        )
+        # hue_mask_gray coverts the hsv image into a single channel mask with a
+        # bandpass applied centered around hue, with width sigma, and converts
+        # it to a b&w mask by thresholding at 200 in the same pass
+        if moments:
+            # Keep the soft mask for the centroid and threshold it separately
+            soft_mask = hue_mask_gray(img_hsv, hue / 2, 0.03, 60.0, 1.5)
+            mask = cv2.threshold(soft_mask, 199, 255, cv2.THRESH_BINARY)[1]
+        else:
+            mask = hue_mask_gray(img_hsv, hue / 2, 0.03, 60.0, 1.5, 200)
 
         # expand b&w image with a dialation filter
         mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
@@ -104,14 +211,27 @@ def hsv_detector(
             cv2.CHAIN_APPROX_SIMPLE,
         )[-2]
 
+        if debug and tracking:
+            cv2.rectangle(img, (x0, y0), (x1 - 1, y1 - 1), (128, 128, 128), 1)
+
         if len(contours) > 0:
             contour_peak = max(contours, key=cv2.contourArea)
             ((x_obs, y_obs), radius) = cv2.minEnclosingCircle(contour_peak)
+            if moments:
+                # The enclosing circle still sizes the ball, the centroid of
+                # the soft mask gives a sub-pixel (and less jittery) center
+                centroid = soft_centroid(soft_mask, contour_peak)
+                if centroid is not None:
+                    x_obs, y_obs = centroid
+
+            # Move from window coordinates back to frame coordinates
+            x_obs, y_obs = x_obs + x0, y_obs + y0
 
             # Determine if ball size is the appropriate size
             norm_radius = radius / frame_size
             if ball_min < norm_radius < ball_max:
                 ball_detected = True
+                update_track(ball_detected, x_obs, y_obs, radius)
 
                 # Convert from pixels to absolute with 0,0 as center of detected plate
                 x = x_obs - frame_size // 2
@@ -120,7 +240,7 @@ def hsv_detector(
                 if debug:
                     ball_center_pixels = (int(x_obs), int(y_obs))
                     draw_ball(img, ball_center_pixels, radius, hue)
-                    save_img(filename, img, rotated=False, quality=80)
+                    save_frame(img, filename)
 
                 # Rotate the x, y coordinates by -30 degrees
                 center = Vector2(x, y).rotate(np.radians(-30))
@@ -129,10 +249,13 @@ def hsv_detector(
 
         # If there were no contours or no contours the size of the ball
         ball_detected = False
+        update_track(ball_detected)
         if debug:
-            save_img(filename, img, rotated=False, quality=80)
+            save_frame(img, filename)
         return ball_detected, (Vector2(0, 0), 0.0)
 
+    # Forget the track, the next frame is searched in full (ie on env reset)
+    detect_features.reset_track = reset_track
     return detect_features
 
 
@@ -1,12 +1,24 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import os
 import json
+import time
+import socket
 import argparse
 import requests
+import tempfile
 import subprocess
+import http.client
+import logging as log
 
-from dataclasses import dataclass
+from urllib.parse import urlencode
+from dataclasses import dataclass, asdict
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+# Not /tmp, where anyone could plant one. menu.service has systemd create
+# /run/moab for its user (RuntimeDirectory=moab).
+CACHE_FILE = "/run/moab/brains.json"
 
 
 @dataclass
@@ -175,5 +187,154 @@ def list_to_bonsai_images(iot_dict):
     return bonsai_images
 
 
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """An http.client connection to a server on a unix domain socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def api_to_ps_info(container):
+    """A container from the Docker API in the `docker ps` format used above."""
+    names = container.get("Names") or []
+    info = {
+        "Image": container["Image"],
+        "Names": names[0].lstrip("/") if names else None,
+        "Networks": ",".join(container.get("NetworkSettings", {}).get("Networks", {})),
+    }
+
+    # Published ports only, IPv4 first like `docker ps`
+    ports = [p for p in container.get("Ports", []) if "PublicPort" in p]
+    ports.sort(key=lambda p: ":" in p.get("IP", ""))
+    if ports:
+        info["Ports"] = ", ".join(
+            f"{p.get('IP', '0.0.0.0')}:{p['PublicPort']}"
+            f"->{p['PrivatePort']}/{p['Type']}"
+            for p in ports
+        )
+    return info
+
+
+def _trusted(path):
+    # Owned by this user and not writable by anyone else, the file and its
+    # directory (which could otherwise have it swapped out)
+    for p in (path, os.path.dirname(os.path.abspath(path))):
+        st = os.stat(p)
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            return False
+    return True
+
+
+class BrainCache:
+    """
+    The brains running in docker, as ps() returns them, but from the Docker
+    API over its socket instead of a `docker ps` subprocess.
+
+    The list is kept in memory and in `cache_file` (so it survives restarts of
+    the menu; the file is only used if this user owns it and its directory and
+    no one else can write to them), and is only fetched again when the Docker
+    events since the last look show a container started, stopped or renamed.
+    Checking for those is one small request, so refreshing is instant when
+    nothing changed. Falls back to ps() if the Docker socket can't be used.
+    """
+
+    events = ["start", "die", "destroy", "rename"]
+
+    def __init__(self, socket_path=DOCKER_SOCKET, cache_file=CACHE_FILE, timeout=2.0):
+        self.socket_path = socket_path
+        self.cache_file = cache_file
+        self.timeout = timeout
+        self.brains = None
+        self.checked = 0.0  # Time of the last look at docker
+
+        try:
+            if not _trusted(cache_file):
+                raise ValueError(f"{cache_file} could have been written by others")
+            with open(cache_file) as f:
+                cache = json.load(f)
+            self.brains = [BonsaiImage(**brain) for brain in cache["brains"]]
+            self.checked = cache["checked"]
+        except FileNotFoundError:
+            pass  # No cache yet
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning(f"Not using the brain cache: {e}")
+
+    def _get(self, path, **params):
+        connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        try:
+            connection.request("GET", f"{path}?{urlencode(params)}")
+            response = connection.getresponse()
+            body = response.read()
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise OSError(f"Docker API {path}: {response.status} {body!r}")
+        return body
+
+    def _changed(self, now):
+        # Container events between the last look and now. With an `until` the
+        # API returns straight away instead of streaming new events.
+        events = self._get(
+            "/events",
+            since=f"{self.checked:.9f}",
+            until=f"{now:.9f}",
+            filters=json.dumps({"type": ["container"], "event": self.events}),
+        )
+        return bool(events.strip())
+
+    def _list(self):
+        containers = json.loads(self._get("/containers/json"))
+        infos = [api_to_ps_info(container) for container in containers]
+        return sorted(list_to_bonsai_images(infos), key=lambda x: x.port)
+
+    def _save(self):
+        cache = {"checked": self.checked, "brains": [asdict(b) for b in self.brains]}
+        cache_dir = os.path.dirname(self.cache_file) or "."
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # A new private file, so nothing else can be written in its place
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=".brains")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp, self.cache_file)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def __call__(self, full=False):
+        """The brains, listed again if anything changed (or if `full`)."""
+        now = time.time()
+        try:
+            if full or self.brains is None or self._changed(now):
+                self.brains = self._list()
+            self.checked = now
+        except (OSError, ValueError) as e:
+            log.warning(f"Docker API not available ({e}), using docker ps")
+            return ps() or []
+
+        try:
+            self._save()
+        except OSError as e:
+            log.warning(f"Could not save the brain cache: {e}")
+        return self.brains
+
+
+_brain_cache = None
+
+
+def brains(full=False):
+    """The brains running in docker, see BrainCache."""
+    global _brain_cache
+    if _brain_cache is None:
+        _brain_cache = BrainCache()
+    return _brain_cache(full)
+
+
 if __name__ == "__main__":
     print(ps())
@@ -1,11 +1,15 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+from sim import SimulatedHardware
 from hardware import MoabHardware
+from scheduler import RateScheduler
+from functools import partial
 from typing import Tuple, Optional
 from dataclasses import dataclass, astuple
 from hat import Hat, Buttons, Icon, PowerIcon
 from common import high_pass_filter, low_pass_filter, derivative
+from common import derivative_estimator
 
 
 @dataclass
@@ -37,22 +41,52 @@ class MoabEnv:
         debug=False,
         verbose=0,
         derivative_fn=derivative,
+        estimator_fn=None,  # Builds the state estimator, see common.py
         calibration_file="bot.json",
+        pipelined_camera=False,
+        tracking_detector=False,
+        localization="circle",  # Ball center from the detector, see hsv_detector
+        stream_transport="file",
+        profile=False,
+        async_hat=False,
+        trace_file=None,
+        simulate=False,  # Use a SimulatedHardware, stepped as fast as possible
+        **sim_kwargs,  # Passed on to SimulatedHardware
     ):
         self.debug = debug
         self.verbose = verbose
         self.frequency = frequency
-        self.derivative_fn = derivative
-        self.vel_x = self.derivative_fn(frequency)
-        self.vel_y = self.derivative_fn(frequency)
+        self.derivative_fn = derivative_fn
+        # By default the velocity is derivative_fn of the measured position
+        self.estimator_fn = estimator_fn or partial(
+            derivative_estimator, derivative_fn=derivative_fn
+        )
+        self.estimator = self.estimator_fn(frequency)
         self.sum_x, self.sum_y = 0, 0
 
-        self.hardware = MoabHardware(
+        hardware_class = MoabHardware
+        if simulate:
+            hardware_class = partial(SimulatedHardware, **sim_kwargs)
+
+        self.hardware = hardware_class(
             frequency=frequency,
             debug=debug,
             verbose=verbose,
             calibration_file=calibration_file,
+            pipelined_camera=pipelined_camera,
+            tracking_detector=tracking_detector,
+            localization=localization,
+            stream_transport=stream_transport,
+            profile=profile,
+            async_hat=async_hat,
+            trace_file=trace_file,
+        )
+
+        # Paces step() at `frequency` and times the phases inside the step
+        self.scheduler = RateScheduler(
+            frequency, profiler=self.hardware.profiler, realtime=not simulate
         )
+        self.hardware.phase = self.scheduler.phase
 
     def __enter__(self):
         self.hardware.__enter__()
@@ -65,14 +99,15 @@ class MoabEnv:
         # Optionally display the controller active text
         self.hardware.display(text, icon)
 
-        # Reset the derivative of the position
+        # Reset the state estimator (ie the derivative of the position)
         # Use a high pass filter instead of a numerical derivative for stability.
         # A high pass filtered signal can be thought of as a derivative of a low
         # pass filtered signal: fc*s / (s + fc) = fc*s * 1 / (s + fc)
         # For more info: https://en.wikipedia.org/wiki/Differentiator
         # Or: https://www.youtube.com/user/ControlLectures/
-        self.vel_x = self.derivative_fn(self.frequency)
-        self.vel_y = self.derivative_fn(self.frequency)
+        self.estimator = self.estimator_fn(self.frequency)
+        # The ball may have moved since the last run, search the full frame
+        self.hardware.reset_tracking()
         # Reset the integral of the position
         self.sum_x, self.sum_y = 0, 0
 
@@ -80,11 +115,18 @@ class MoabEnv:
         return self.step((0, 0))
 
     def step(self, action) -> Tuple[EnvState, bool, Buttons]:
+        # Wait for the next tick deadline (accounts for the time already spent
+        # since the last step, ie in the controller)
+        self.scheduler.wait()
+
         pitch, roll = action
         (x, y), ball_detected, buttons = self.hardware.step(pitch, roll)
 
-        # Update derivate calulation
-        vel_x, vel_y = self.vel_x(x), self.vel_y(y)
+        # Estimate the velocity (and filter the position), using the actual
+        # time between camera frames
+        x, y, vel_x, vel_y = self.estimator(
+            x, y, ball_detected, self.hardware.elapsed_time
+        )
         # Update the summation (integral calculation)
         self.sum_x += x
         self.sum_y += y
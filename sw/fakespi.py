@@ -0,0 +1,134 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+A stand-in for spidev.SpiDev, to run the hat protocol without a hat
+"""
+
+import time
+import struct
+
+from collections import Counter
+from hat import SendCommand
+from hexyl import load_trace
+
+
+class FakeSpiDev:
+    """
+    Answers transfers like the hat does. Pass a trace (recorded with
+    Hat(trace_file=...), see hexyl.py) to replay its replies in order, or leave
+    it out to emulate the firmware (fw/src/app/main.c): the reply carries the
+    buttons and joystick set on this object, and the commands update the
+    servo, text buffer and display state below. A replay falls back to
+    emulating once the trace runs out.
+
+    With realtime=True each transfer takes as long as clocking 8 bytes out at
+    max_speed_hz would.
+
+    Also counts the frames of each command and keeps the timestamps of the
+    servo setpoints, for measuring the SPI layer.
+
+    There is no fileno(): the batched spidev ioctl needs a real spidev, so
+    Hat.transceive_batch falls back to one transceive per frame.
+    """
+
+    def __init__(self, trace=None, realtime=False):
+        if isinstance(trace, str):
+            trace = load_trace(trace)
+        self.trace = trace
+        self.replayed = 0
+        self.mismatches = 0  # Replayed frames whose tx differs from the trace
+        self.realtime = realtime
+        self.max_speed_hz = 100000
+        self.mode = 0
+
+        # Inputs, as they'd be read by the hat
+        self.menu_button = False
+        self.joy_button = False
+        self.joy_x = 0  # -100 to +100
+        self.joy_y = 0
+
+        # Firmware state
+        self.servos_enabled = False
+        self.servos = (0.0, 0.0, 0.0)  # Servo 1, 2 & 3 in degrees
+        self.message_buffer = bytearray(248)
+        self.mb_idx = 0
+        self.display = None  # (command, text, icon) last shown
+
+        # Stats
+        self.frames = 0
+        self.frames_by_command = Counter()
+        self.servo_times = []  # (monotonic time, servos) of every SET_SERVOS
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def reply(self) -> bytes:
+        return struct.pack(
+            ">BBbb4x",
+            self.menu_button,
+            self.joy_button,
+            self.joy_x,
+            self.joy_y,
+        )
+
+    def xfer(self, values):
+        # Like py-spidev, which only takes python ints (not ie np.int8)
+        if not all(type(v) is int for v in values):
+            raise TypeError("Non-Int/Long value in arguments")
+        tx = bytes(v & 0xFF for v in values)
+        assert len(tx) == 8
+
+        if self.realtime:
+            time.sleep(64 / self.max_speed_hz)
+
+        # The hat fills in its reply before it sees the command
+        if self.trace is not None and self.replayed < len(self.trace):
+            record = self.trace[self.replayed]
+            self.replayed += 1
+            if bytes(record["tx"]) != tx:
+                self.mismatches += 1
+            rx = bytes(record["rx"])
+        else:
+            rx = self.reply()
+
+        self._emulate(tx)
+        return list(rx)
+
+    xfer2 = xfer
+
+    def _emulate(self, tx: bytes):
+        command = tx[0]
+        self.frames += 1
+        self.frames_by_command[command] += 1
+
+        if command == SendCommand.COPY_STRING:
+            if self.mb_idx == 0:
+                self.message_buffer[:] = bytes(len(self.message_buffer))
+            if self.mb_idx < 240:
+                self.message_buffer[self.mb_idx : self.mb_idx + 7] = tx[1:]
+                self.mb_idx += 7
+
+        elif (
+            SendCommand.DISPLAY_BIG_TEXT_ICON
+            <= command
+            <= SendCommand.DISPLAY_POWER_SYMBOL
+        ):
+            self.message_buffer[self.mb_idx] = 0
+            self.mb_idx = 0
+            text = bytes(self.message_buffer).split(b"\0")[0].decode()
+            self.display = (SendCommand(command), text, tx[1])
+
+        elif command == SendCommand.SET_SERVOS:
+            s3, s1, s2 = struct.unpack(">3h", tx[1:7])
+            self.servos = (s1 / 100, s2 / 100, s3 / 100)
+            self.servo_times.append((time.monotonic(), self.servos))
+
+        elif command == SendCommand.SERVO_ENABLE:
+            self.servos_enabled = True
+
+        elif command == SendCommand.SERVO_DISABLE:
+            self.servos_enabled = False
@@ -2,15 +2,19 @@
 # Licensed under the MIT License.
 
 import os
+import math
 import time
 import json
 import numpy as np
 
 from settings import get_settings
+from contextlib import nullcontext
 from detector import hsv_detector
 from typing import Tuple, Optional
 from camera import OpenCVCameraSensor
-from hat import Hat, Buttons, Icon, PowerIcon
+from publisher import FramePublisher
+from profiler import LatencyProfiler
+from hat import Hat, AsyncHat, Buttons, Icon, PowerIcon, DEFAULT_SPI_SPEED_HZ
 
 
 def plate_angles_to_servo_positions(
@@ -22,26 +26,108 @@ def plate_angles_to_servo_positions(
     angle_max: float = 160,
     angle_min: float = 90,
 ) -> Tuple[float, float, float]:
-    servo_angles = [0.0, 0.0, 0.0]
+    # Scalar math is much faster than numpy for a single pitch/roll, see
+    # plate_angles_to_servo_positions_batch for arrays of them
+    sin_roll = math.sin(math.radians(roll))
+    sin_pitch = math.sin(math.radians(-pitch))
 
-    z1 = pivot_height + np.sin(np.radians(roll)) * (side_len / np.sqrt(3))
-    r = pivot_height - np.sin(np.radians(roll)) * (side_len / (2 * np.sqrt(3)))
-    z2 = r + np.sin(np.radians(-pitch)) * (side_len / 2)
-    z3 = r - np.sin(np.radians(-pitch)) * (side_len / 2)
+    z1 = pivot_height + sin_roll * (side_len / math.sqrt(3))
+    r = pivot_height - sin_roll * (side_len / (2 * math.sqrt(3)))
+    z2 = r + sin_pitch * (side_len / 2)
+    z3 = r - sin_pitch * (side_len / 2)
 
-    if z1 > 2 * arm_len:
-        z1 = 2 * arm_len
-    if z2 > 2 * arm_len:
-        z2 = 2 * arm_len
-    if z3 > 2 * arm_len:
-        z3 = 2 * arm_len
+    reach = 2 * arm_len
+    s1 = 180 - math.degrees(math.asin(min(z1, reach) / reach))
+    s2 = 180 - math.degrees(math.asin(min(z2, reach) / reach))
+    s3 = 180 - math.degrees(math.asin(min(z3, reach) / reach))
 
-    servo_angles[0] = 180 - (np.degrees(np.arcsin(z1 / (2 * arm_len))))
-    servo_angles[1] = 180 - (np.degrees(np.arcsin(z2 / (2 * arm_len))))
-    servo_angles[2] = 180 - (np.degrees(np.arcsin(z3 / (2 * arm_len))))
+    return (
+        min(max(s1, angle_min), angle_max),
+        min(max(s2, angle_min), angle_max),
+        min(max(s3, angle_min), angle_max),
+    )
 
-    servo_angles = np.clip(servo_angles, angle_min, angle_max)
-    return servo_angles
+
+def plate_angles_to_servo_positions_batch(
+    pitch,
+    roll,
+    arm_len: float = 55.0,
+    side_len: float = 170.87,
+    pivot_height: float = 80.0,
+    angle_max: float = 160,
+    angle_min: float = 90,
+) -> np.ndarray:
+    """
+    plate_angles_to_servo_positions for arrays of N pitch & roll angles (either
+    may be a scalar). Returns an (N, 3) array of servo positions.
+    """
+    pitch, roll = np.broadcast_arrays(
+        np.ravel(np.asarray(pitch, dtype=np.float64)),
+        np.ravel(np.asarray(roll, dtype=np.float64)),
+    )
+    sin_roll = np.sin(np.radians(roll))
+    sin_pitch = np.sin(np.radians(-pitch))
+
+    z = np.empty((len(pitch), 3))
+    r = pivot_height - sin_roll * (side_len / (2 * np.sqrt(3)))
+    z[:, 0] = pivot_height + sin_roll * (side_len / np.sqrt(3))
+    z[:, 1] = r + sin_pitch * (side_len / 2)
+    z[:, 2] = r - sin_pitch * (side_len / 2)
+
+    reach = 2 * arm_len
+    np.minimum(z, reach, out=z)
+    servos = 180 - np.degrees(np.arcsin(z / reach))
+    return np.clip(servos, angle_min, angle_max, out=servos)
+
+
+class ServoTransform:
+    """
+    Plate pitch & roll to what goes out to the hat, in one place: the inverse
+    kinematics of plate_angles_to_servo_positions, the calibration's servo
+    offsets and the conversion to the hat's fixed point centi-degrees.
+
+    The same transform gives servo positions in degrees (servo_positions), for
+    arrays of angles (batch) and the words for Hat.set_servo_words (words).
+    """
+
+    def __init__(
+        self,
+        servo_offsets: Tuple[float, float, float] = (0.0, 0.0, 0.0),
+        arm_len: float = 55.0,
+        side_len: float = 170.87,
+        pivot_height: float = 80.0,
+        angle_max: float = 160,
+        angle_min: float = 90,
+    ):
+        self.servo_offsets = tuple(servo_offsets)
+        self.geometry = dict(
+            arm_len=arm_len,
+            side_len=side_len,
+            pivot_height=pivot_height,
+            angle_max=angle_max,
+            angle_min=angle_min,
+        )
+
+    def servo_positions(self, pitch: float, roll: float) -> Tuple[float, float, float]:
+        """The servo positions in degrees, offsets included."""
+        s1, s2, s3 = plate_angles_to_servo_positions(pitch, roll, **self.geometry)
+        o1, o2, o3 = self.servo_offsets
+        return s1 + o1, s2 + o2, s3 + o3
+
+    def words(self, pitch: float, roll: float) -> Tuple[int, int, int]:
+        """The servo positions as the hat takes them, hundredths of a degree."""
+        s1, s2, s3 = self.servo_positions(pitch, roll)
+        return int(s1 * 100), int(s2 * 100), int(s3 * 100)
+
+    def batch(self, pitch, roll) -> np.ndarray:
+        """servo_positions for arrays of N pitch & roll angles, (N, 3)."""
+        servos = plate_angles_to_servo_positions_batch(pitch, roll, **self.geometry)
+        servos += self.servo_offsets
+        return servos
+
+
+def _untimed(name):
+    return nullcontext()
 
 
 class MoabHardware:
@@ -51,22 +137,68 @@ class MoabHardware:
         debug=False,
         verbose=0,
         calibration_file="bot.json",
+        pipelined_camera=False,
+        tracking_detector=False,
+        localization="circle",
+        stream_fps=10,
+        stream_transport="file",
+        profile=False,
+        async_hat=False,
+        trace_file=None,
     ):
         self.debug = debug
         self.verbose = verbose
         self.frequency = frequency
 
-        self.hat = Hat(debug=debug, verbose=verbose)
+        # The SPI speed in bot.json (ie from Hat.autotune_spi_speed), if any
+        self.calibration_file = calibration_file
+        spi_speed_hz = get_settings(calibration_file).get("spi_speed_hz")
+        # AsyncHat moves the SPI traffic onto a worker thread
+        hat_class = AsyncHat if async_hat else Hat
+        self.hat = hat_class(
+            debug=debug,
+            verbose=verbose,
+            spi_speed_hz=spi_speed_hz or DEFAULT_SPI_SPEED_HZ,
+            trace_file=trace_file,
+        )
         self.hat.open()
-        self.camera = OpenCVCameraSensor(frequency=frequency)
-        self.detector = hsv_detector(debug=debug)
+        if async_hat:
+            self.hat.start()
+        self.camera = OpenCVCameraSensor(
+            frequency=frequency, pipelined=pipelined_camera
+        )
+        # Debug frames are published to the stream service at a lower rate
+        self.publisher = None
+        if debug:
+            self.publisher = FramePublisher(fps=stream_fps, transport=stream_transport)
+        self.detector = hsv_detector(
+            debug=debug,
+            tracking=tracking_detector,
+            publisher=self.publisher,
+            localization=localization,
+        )
 
         # Set the calibration
-        self.calibration_file = calibration_file
         self.reset_calibration()
 
+        # Called with a phase name around each part of step. Returns a context
+        # manager; replace it (ie with RateScheduler.phase) to time the phases.
+        self.phase = _untimed
+
+        # Seconds between the last two camera frames, for the state estimator
+        self.elapsed_time = 1 / frequency
+
+        # Opt-in rolling latency percentiles of the step phases & SPI transfers
+        self.profiler = None
+        if profile:
+            self.profiler = LatencyProfiler()
+            self.phase = self.profiler.phase
+            self.hat.profiler = self.profiler
+
     def __enter__(self):
         self.camera.start()
+        if self.publisher:
+            self.publisher.start()
         return self
 
     def __exit__(self, type, value, traceback):
@@ -75,6 +207,8 @@ class MoabHardware:
         self.hat.display_power_symbol("TO WAKE", PowerIcon.POWER)
         self.hat.close()
         self.camera.stop()
+        if self.publisher:
+            self.publisher.stop()
 
     def __repr__(self):
         return self.__str__()
@@ -88,14 +222,30 @@ class MoabHardware:
             f"servo offsets: {self.servo_offsets}"
         )
 
+    @property
+    def servo_offsets(self):
+        return self.servo_transform.servo_offsets
+
+    @servo_offsets.setter
+    def servo_offsets(self, servo_offsets):
+        # Calibration tools set the offsets directly, keep the transform in step
+        self.servo_transform = ServoTransform(servo_offsets)
+
+    def reset_tracking(self):
+        # A track from the previous run (or calibration) may no longer hold
+        reset_track = getattr(self.detector, "reset_track", None)
+        if reset_track is not None:
+            reset_track()
+
     def reset_calibration(self, calibration_file=None):
         # Use default if not defined
         calibration_file = calibration_file or self.calibration_file
         settings_dict = get_settings(calibration_file)
 
-        self.servo_offsets = settings_dict["servo_offsets"]
+        self.servo_offsets = settings_dict["servo_offsets"]  # Also sets the transform
         self.plate_offsets = settings_dict["plate_offsets"]
         self.hue = settings_dict["ball_hue"]
+        self.reset_tracking()
 
     def go_up(self):
         # Set the plate to its hover position, experimentally found to be 150
@@ -141,14 +291,31 @@ class MoabHardware:
                 self.hat.display_string(text)
 
     def set_angles(self, pitch, roll):
-        s1, s2, s3 = plate_angles_to_servo_positions(pitch, roll)
-        self.set_servos(s1, s2, s3)
+        self.hat.set_servo_words(self.servo_transform.words(pitch, roll))
 
     def step(self, pitch, roll) -> Buttons:
-        self.set_angles(pitch, roll)
-        frame, elapsed_time = self.camera()
+        with self.phase("spi"):
+            self.set_angles(pitch, roll)
+        with self.phase("camera"):
+            frame, elapsed_time = self.camera()
+        self.elapsed_time = elapsed_time
         buttons = self.hat.get_buttons()
-        ball_detected, (ball_center, ball_radius) = self.detector(
-            frame, hue=self.hue
-        )
+        with self.phase("detect"):
+            ball_detected, (ball_center, ball_radius) = self.detector(
+                frame, hue=self.hue
+            )
+
+        if self.profiler is not None:
+            self.profiler.record("frame_interval", int(elapsed_time * 1e9))
+            self.profiler.maybe_log()
+
         return ball_center, ball_detected, buttons
+
+    def latency_stats(self):
+        """
+        Rolling p50/p95/p99 (in ms) of each step phase and of the SPI
+        transfers. Empty unless the hardware was created with profile=True.
+        """
+        if self.profiler is None:
+            return {}
+        return self.profiler.percentiles()
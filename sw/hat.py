@@ -3,17 +3,26 @@
 
 import os
 import time
+import fcntl
+import ctypes
+import struct
 import signal
+import threading
 
 import socket
-import spidev
 import numpy as np
 import logging as log
-import RPi.GPIO as gpio
 
-from hexyl import hexyl
+try:
+    import spidev
+    import RPi.GPIO as gpio
+except ImportError:
+    # Not on a Pi, a Hat can still be driven through a fakespi.FakeSpiDev
+    spidev = gpio = None
+
+from hexyl import SpiRecorder, reply_ok
 from enum import IntEnum
-from dataclasses import dataclass, astuple
+from collections import deque
 from typing import Union, List, Tuple, Optional
 
 # fmt: off
@@ -51,23 +60,82 @@ class PowerIcon(IntEnum):
     POWER_OFF = 5
 
 
-@dataclass
 class Buttons:
-    menu_button: bool = False
-    joy_button: bool = False
-    joy_x: float = 0.0
-    joy_y: float = 0.0
+    # Slotted (rather than a dataclass) since one is updated on every reply
+    __slots__ = ("menu_button", "joy_button", "joy_x", "joy_y")
+
+    def __init__(self, menu_button=False, joy_button=False, joy_x=0.0, joy_y=0.0):
+        self.menu_button = menu_button
+        self.joy_button = joy_button
+        self.joy_x = joy_x
+        self.joy_y = joy_y
 
     def __iter__(self):
-        return iter(astuple(self))
+        return iter((self.menu_button, self.joy_button, self.joy_x, self.joy_y))
+
+    def __eq__(self, other):
+        return isinstance(other, Buttons) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return (
+            f"Buttons(menu_button={self.menu_button}, "
+            f"joy_button={self.joy_button}, "
+            f"joy_x={self.joy_x}, joy_y={self.joy_y})"
+        )
 
 
 # GPIO pins
 class GpioPin(IntEnum):
     HAT_EN    = 20  # Bcm 20 - RPi pin 38 - RPI_BPLUS_GPIO_J8_38
     HAT_RESET = 6   # Bcm 6  - RPi pin 31 - RPI_BPLUS_GPIO_J8_31
+
+# Minimum time (seconds) to leave after sending a command before the next
+# transfer, giving the hat time to pick up the message. Commands not listed
+# use DEFAULT_MESSAGE_GAP.
+DEFAULT_MESSAGE_GAP = 0.005
+MESSAGE_GAPS = {
+    SendCommand.COPY_STRING:    0.015,
+}
+
+# Spacing between the 8 byte frames of a batched transfer (microseconds). The
+# hat's SPI thread only has to queue each frame and re-arm.
+BATCH_FRAME_GAP_US = 250
+
+# SPI clock rates tried by the self-test, slowest (known good) first. The
+# self-test only goes past the rate the hat has always run at when asked to.
+DEFAULT_SPI_SPEED_HZ = 100000
+SPI_SPEEDS_HZ = (100000, 250000, 500000, 1000000, 2000000, 4000000)
 # fmt: on
 
+# Packet layouts, all 8 bytes. 16-bit fields are sent high byte first.
+_COMMAND = struct.Struct(">BB6x")  # command, icon
+_SERVOS = struct.Struct(">Bhhhx")  # command, servo 3, 1 & 2 in centidegrees
+_REPLY = struct.Struct(">BBbb4x")  # menu button, joy button, joy x & y
+
+
+# Linux spidev ioctl interface (linux/spi/spidev.h), used to send several 8 byte
+# frames in one system call with chip select released between them
+class _SpiIocTransfer(ctypes.Structure):
+    _fields_ = [
+        ("tx_buf", ctypes.c_uint64),
+        ("rx_buf", ctypes.c_uint64),
+        ("len", ctypes.c_uint32),
+        ("speed_hz", ctypes.c_uint32),
+        ("delay_usecs", ctypes.c_uint16),
+        ("bits_per_word", ctypes.c_uint8),
+        ("cs_change", ctypes.c_uint8),
+        ("tx_nbits", ctypes.c_uint8),
+        ("rx_nbits", ctypes.c_uint8),
+        ("word_delay_usecs", ctypes.c_uint8),
+        ("pad", ctypes.c_uint8),
+    ]
+
+
+def _spi_ioc_message(n: int) -> int:
+    # _IOW(SPI_IOC_MAGIC, 0, char[SPI_MSGSIZE(n)])
+    size = n * ctypes.sizeof(_SpiIocTransfer)
+    return (1 << 30) | (size << 16) | (ord("k") << 8)
+
 
 # Helper functions -------------------------------------------------------------
 def _uint8_to_int8(b: int) -> int:
@@ -84,28 +152,6 @@ def _int8_to_uint8(b: int) -> int:
     return np.uint8(b)
 
 
-def _xy_offsets(
-    x: float,
-    y: float,
-    servo_offsets: Tuple[float, float, float],
-    x_tilt_servo1: float = -0.5,
-    y_tilt_servo2: float = 0.866,
-    y_tilt_servo3: float = -0.866,
-) -> Tuple[float, float]:
-    so_1, so_2, so_3 = servo_offsets
-    x_offset = x + so_1 + x_tilt_servo1 * so_2 + x_tilt_servo1 * so_3
-    y_offset = y + y_tilt_servo2 * so_2 + y_tilt_servo3 * so_3
-    return x_offset, y_offset
-
-
-# Return an exact 8 byte numpy array
-def pad(*args, **kwargs):
-    data = [*args][:8]
-    pads = (8 - len(data)) * [0]
-    dtype = kwargs.pop("dtype", np.int8)
-    return np.array(data + pads, dtype)
-
-
 class Hat:
     """
     A helper class that solely does SPI messages. It contains some state for the
@@ -117,20 +163,56 @@ class Hat:
         self,
         debug=False,
         verbose=0,
+        message_gaps=None,  # Override MESSAGE_GAPS per command
+        spi_speed_hz=DEFAULT_SPI_SPEED_HZ,
+        batch_frame_gap_us=BATCH_FRAME_GAP_US,
+        spi=None,  # Use this spidev.SpiDev like object instead of the bus
+        trace_file=None,  # Save every transfer to this file (see hexyl.py)
     ):
         self.buttons = Buttons(False, False, 0.0, 0.0)
         self.debug = debug
         self.verbose = verbose
-        if debug:
-            self.hex_printer = hexyl()
+        self.recorder = None
+        if debug or trace_file:
+            # Transfers are recorded as raw bytes and printed from a thread
+            self.recorder = SpiRecorder(
+                verbose=verbose if debug else 0, trace_file=trace_file
+            )
+        self.fake_spi = spi
         self.spi = None
+        self.spi_speed_hz = spi_speed_hz
+        self.profiler = None  # Optional LatencyProfiler, times every transfer
+
+        # Pacing: the earliest time the next transfer may start
+        self.message_gaps = {**MESSAGE_GAPS, **(message_gaps or {})}
+        self.ready_time = 0.0
+        self.batch_frame_gap_us = batch_frame_gap_us
+
+        # Packets are encoded into, and replies decoded from, these buffers so
+        # a transfer doesn't allocate
+        self.tx = bytearray(8)
+        self.rx = bytearray(8)
+
+        # What the display is currently showing: (command, text, icon) of the
+        # last display call, used to skip uploading the same screen again
+        self.shown = None
 
     def open(self):
+        if self.fake_spi is not None:
+            # No bus or GPIO pins to set up
+            self.spi = self.fake_spi
+            self.spi.max_speed_hz = self.spi_speed_hz
+            self.shown = None
+            if self.recorder is not None:
+                self.recorder.start()
+            return
+
         # Attempt to open the spidev bus
         try:
             self.spi = spidev.SpiDev()
             self.spi.open(0, 0)
-            self.spi.max_speed_hz = 100000
+            self.spi.max_speed_hz = self.spi_speed_hz
+            self.shown = None  # The hat is rebooted below
         except Exception as e:
             # possible that ctrl-C was caught here
             raise IOError(f"Could not open `/dev/spidev{spi_bus}.{spi_device}`.")
@@ -150,9 +232,52 @@ class Hat:
         except:
             raise IOError(f"Could not setup GPIO pins")
 
+        if self.recorder is not None:
+            self.recorder.start()
+
     def close(self):
         if self.spi is not None:
             self.spi.close()
+        if self.recorder is not None:
+            self.recorder.stop()
+
+    def autotune_spi_speed(
+        self, speeds=SPI_SPEEDS_HZ, trials=20, max_speed_hz=DEFAULT_SPI_SPEED_HZ
+    ) -> int:
+        """
+        Self-test: send NOOPs at increasing SPI clock rates, up to
+        max_speed_hz, and keep the fastest rate at which every reply passes the
+        reply invariants (see hexyl.reply_ok). Stops at the first rate with a
+        bad reply. Leaves the SPI bus at the chosen rate and returns it.
+
+        The replies only show what the hat sent back: a command the hat got
+        garbled goes unnoticed (an idle reply is all zeros and always passes),
+        hence the cap at the rate the hat is known to work at. Raise it only
+        to try out faster rates on the bench.
+        """
+        assert self.spi is not None  # did you call hat.open() first ?
+
+        best = speeds[0]
+        for speed in (s for s in speeds if s <= max_speed_hz):
+            self.spi.max_speed_hz = speed
+            noop = self._encode(SendCommand.NOOP)
+            replies = [self.transceive(noop) for _ in range(trials)]
+            if not all(reply_ok(rx) for rx in replies):
+                log.warning(f"SPI self-test failed at {speed} Hz")
+                break
+            best = speed
+
+        self.spi_speed_hz = best
+        self.spi.max_speed_hz = best
+
+        # A garbled frame at a failing rate may have been taken as the start
+        # of a string; displaying clears the hat's string buffer. Forget what
+        # is shown, or an already blank screen would skip the send.
+        self.shown = None
+        self.display_string("")
+
+        log.info(f"SPI speed set to {best} Hz")
+        return best
 
     def __enter__(self):
         self.open()
@@ -161,26 +286,104 @@ class Hat:
     def __exit__(self, type, value, traceback):
         self.close()
 
-    def transceive(self, packet: np.ndarray):
+    def _wait_until_ready(self):
+        # Only wait for whatever is left of the gap the previous command needs
+        # (usually nothing when called once per control tick)
+        delay = self.ready_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _sent(self, command: int):
+        gap = self.message_gaps.get(command & 0xFF, DEFAULT_MESSAGE_GAP)
+        self.ready_time = time.monotonic() + gap
+
+    def _encode(self, command: SendCommand, icon_idx: int = 0) -> bytearray:
+        _COMMAND.pack_into(self.tx, 0, command, icon_idx)
+        return self.tx
+
+    def _update_buttons(self, reply, offset=0):
+        menu, joy, joy_x, joy_y = _REPLY.unpack_from(reply, offset)
+
+        # Check if buttons are pressed
+        self.buttons.menu_button = menu == 1
+        self.buttons.joy_button = joy == 1
+
+        # Get x & y coordinates of joystick normalized to [-1, +1]
+        self.buttons.joy_x = joy_x / 100
+        self.buttons.joy_y = joy_y / 100
+
+    def transceive(self, packet):
         """
-        Send and receive 8 bytes from hat.
+        Send and receive 8 bytes from hat. `packet` is any 8 byte sequence,
+        usually one of the reused buffers filled by the encoders below.
+        Returns the raw reply.
         """
         assert self.spi is not None  # did you call hat.open() first ?
         assert len(packet) == 8
 
-        hat_to_pi = self.spi.xfer(packet.tolist())
-        time.sleep(0.005)
+        self._wait_until_ready()
 
-        if self.debug:
-            self.hex_printer(packet.tolist(), hat_to_pi, self.verbose)
+        if self.profiler is not None:
+            start = time.perf_counter_ns()
+            hat_to_pi = self.spi.xfer(packet)
+            self.profiler.record("transceive", time.perf_counter_ns() - start)
+        else:
+            hat_to_pi = self.spi.xfer(packet)
+        self._sent(int(packet[0]))
 
-        # Check if buttons are pressed
-        self.buttons.menu_button = hat_to_pi[0] == 1
-        self.buttons.joy_button = hat_to_pi[1] == 1
+        if self.recorder is not None:
+            self.recorder.record(packet, hat_to_pi)
 
-        # Get x & y coordinates of joystick normalized to [-1, +1]
-        self.buttons.joy_x = _uint8_to_int8(hat_to_pi[2]) / 100
-        self.buttons.joy_y = _uint8_to_int8(hat_to_pi[3]) / 100
+        self.rx[:] = hat_to_pi
+        self._update_buttons(self.rx)
+        return hat_to_pi
+
+    def transceive_batch(self, frames: bytes) -> List[List[int]]:
+        """
+        Send several 8 byte frames back to back and return their replies.
+
+        The hat reads exactly one frame per chip select, so the frames can't be
+        merged into a single transfer. Instead they go out as one spidev
+        message (one system call) with chip select released between frames and
+        `batch_frame_gap_us` between them. Falls back to one transceive per
+        frame if the ioctl isn't available.
+        """
+        assert self.spi is not None  # did you call hat.open() first ?
+        assert len(frames) % 8 == 0
+        n = len(frames) // 8
+
+        self._wait_until_ready()
+
+        tx = ctypes.create_string_buffer(frames, len(frames))
+        rx = ctypes.create_string_buffer(len(frames))
+        transfers = (_SpiIocTransfer * n)()
+        for i, t in enumerate(transfers):
+            t.tx_buf = ctypes.addressof(tx) + 8 * i
+            t.rx_buf = ctypes.addressof(rx) + 8 * i
+            t.len = 8
+            t.speed_hz = self.spi_speed_hz
+            t.bits_per_word = 8
+            t.delay_usecs = self.batch_frame_gap_us
+            t.cs_change = 1 if i < n - 1 else 0  # Release CS between frames
+
+        try:
+            start = time.perf_counter_ns()
+            fcntl.ioctl(self.spi.fileno(), _spi_ioc_message(n), transfers)
+            if self.profiler is not None:
+                self.profiler.record("transceive", time.perf_counter_ns() - start)
+        except (AttributeError, OSError) as e:
+            log.debug(f"Batched SPI unavailable ({e}), sending frames singly")
+            return [self.transceive(frames[8 * i : 8 * i + 8]) for i in range(n)]
+
+        replies = [list(rx.raw[8 * i : 8 * i + 8]) for i in range(n)]
+        self._sent(frames[-8])
+
+        if self.recorder is not None:
+            for i, hat_to_pi in enumerate(replies):
+                self.recorder.record(frames[8 * i : 8 * i + 8], hat_to_pi)
+
+        self._update_buttons(rx, 8 * (n - 1))
+        return replies
 
     def get_buttons(self) -> Buttons:
         """
@@ -189,7 +392,7 @@ class Hat:
 
         Return:
             Buttons
-            Which is a dataclass with:
+            Which has:
                 - menu_button: bool
                 - joy_button : bool
                 - joy_x   : float normalized from -1 to +1
@@ -199,48 +402,37 @@ class Hat:
 
     def noop(self):
         """Send a NOOP. Useful for if you just want to read buttons."""
-        self.transceive(pad(SendCommand.NOOP))
+        self.transceive(self._encode(SendCommand.NOOP))
 
     def enable_servos(self):
         """Set the plate to track plate angles."""
-        self.transceive(pad(SendCommand.SERVO_ENABLE))
+        self.transceive(self._encode(SendCommand.SERVO_ENABLE))
 
     def disable_servos(self):
         """Disables the power to the servos."""
-        self.transceive(pad(SendCommand.SERVO_DISABLE))
+        self.transceive(self._encode(SendCommand.SERVO_DISABLE))
 
     def set_servos(
         self,
         servos: Tuple[float, float, float],
     ):
-        # Note the off by 1 for indexing
         # Use fixed point 16-bit numbers, with precision of hundredths
-        servo1_centi_degrees = np.int16(servos[0] * 100)
-        servo2_centi_degrees = np.int16(servos[1] * 100)
-        servo3_centi_degrees = np.int16(servos[2] * 100)
-
-        # Get the first 8 bits and last 8 bits of every 16-bit integer
-        # (To send it as indivdual bytes)
-        servo1_centi_degrees_high_byte = servo1_centi_degrees >> 8
-        servo1_centi_degrees_low_byte = servo1_centi_degrees & 0x00FF
-        servo2_centi_degrees_high_byte = servo2_centi_degrees >> 8
-        servo2_centi_degrees_low_byte = servo2_centi_degrees & 0x00FF
-        servo3_centi_degrees_high_byte = servo3_centi_degrees >> 8
-        servo3_centi_degrees_low_byte = servo3_centi_degrees & 0x00FF
-
-        self.transceive(
-            pad(
-                SendCommand.SET_SERVOS,
-                servo3_centi_degrees_high_byte,
-                servo3_centi_degrees_low_byte,
-                servo1_centi_degrees_high_byte,
-                servo1_centi_degrees_low_byte,
-                servo2_centi_degrees_high_byte,
-                servo2_centi_degrees_low_byte,
-            )
+        self.set_servo_words(
+            (int(servos[0] * 100), int(servos[1] * 100), int(servos[2] * 100))
         )
 
-    def _copy_buffer(self, s: str):
+    def set_servo_words(self, words: Tuple[int, int, int]):
+        """
+        Set servos 1, 2 & 3 to positions already in hundredths of a degree, ie
+        from hardware.ServoTransform.words.
+        """
+        # Note the off by 1 for indexing: servo 3 is sent first
+        _SERVOS.pack_into(
+            self.tx, 0, SendCommand.SET_SERVOS, words[2], words[0], words[1]
+        )
+        self.transceive(self.tx)
+
+    def _string_frames(self, s: str) -> bytes:
         s = s.upper()  # The firware currently only has uppercase fonts
 
         s = bytes(s, "utf-8")
@@ -254,50 +446,184 @@ class Hat:
         # send in 8 bytes increments (1 byte control, 7 bytes data)
         s += (num_msgs * 7 - len(s)) * b"\0"
 
+        # Interleave the control byte in front of every 7 bytes of data
+        frames = bytearray(num_msgs * 8)
         for msg_idx in range(num_msgs):
-            # Combine into one list to send
-            msg = [SendCommand.COPY_STRING] + list(s[7 * msg_idx : 7 * msg_idx + 7])
-            self.transceive(np.array(msg, dtype=np.int8))
-            time.sleep(0.010)
+            frames[8 * msg_idx] = SendCommand.COPY_STRING
+            frames[8 * msg_idx + 1 : 8 * msg_idx + 8] = s[7 * msg_idx : 7 * msg_idx + 7]
+        return bytes(frames)
+
+    def _copy_buffer(self, s: str):
+        self.transceive_batch(self._string_frames(s))
+
+    def _display_buffer(self, text: str, command: SendCommand, icon_idx: int = 0):
+        # Don't needlessly update the display if it's already showing this
+        shown = (command, text, icon_idx)
+        if shown == self.shown:
+            return
+
+        # Copy the text into a buffer in the firmware and display it, all in
+        # one batch
+        frames = self._string_frames(text) + _COMMAND.pack(command, icon_idx)
+        self.transceive_batch(frames)
+        self.shown = shown
 
     def display_power_symbol(self, text: str, icon_idx: PowerIcon):
         assert len(text) <= 12, "String is too long to display with icon"
 
-        # Copy the text into a buffer in the firmware
-        self._copy_buffer(text)
-
-        # After sending copying to the fw buffer, display the buffer as a short string
-        self.transceive(pad(SendCommand.DISPLAY_POWER_SYMBOL, icon_idx))
+        # Copy the text into a buffer in the firmware, then display the buffer
+        # as a short string
+        self._display_buffer(text, SendCommand.DISPLAY_POWER_SYMBOL, icon_idx)
 
     def display_string_icon(self, text: str, icon_idx: Icon):
         # assert len(text) <= 12, "String is too long to display with icon"
 
-        # Copy the text into a buffer in the firmware
-        self._copy_buffer(text)
-
-        # After sending copying to the fw buffer, display the buffer as a short string
-        self.transceive(pad(SendCommand.DISPLAY_BIG_TEXT_ICON, icon_idx))
+        # Copy the text into a buffer in the firmware, then display the buffer
+        # as a short string
+        self._display_buffer(text, SendCommand.DISPLAY_BIG_TEXT_ICON, icon_idx)
 
     def update_icon(self, icon_idx: Icon):
         # Don't needlessly update display if icon hasn't changed or if last text
         # didn't have an icon (ie last called send text was display_string or
         # display_long_string)
+        if self.shown is None or self.shown[0] != SendCommand.DISPLAY_BIG_TEXT_ICON:
+            return
 
-        # Display the buffer as a long string
-        self.transceive(pad(SendCommand.DISPLAY_BIG_TEXT_ICON, icon_idx))
+        # The firmware empties its text buffer after every display command, so
+        # the text has to be sent along with the new icon
+        self.display_string_icon(self.shown[1], icon_idx)
 
     def display_string(self, text: str):
         assert len(text) <= 15, "String is too long to display without scrolling."
 
-        # Copy the text into a buffer in the firmware
-        self._copy_buffer(text)
-
-        # After sending copying to the fw buffer, display the buffer as a short string
-        self.transceive(pad(SendCommand.DISPLAY_BIG_TEXT))
+        # Copy the text into a buffer in the firmware, then display the buffer
+        # as a short string
+        self._display_buffer(text, SendCommand.DISPLAY_BIG_TEXT)
 
     def display_long_string(self, text: str):
-        # Copy the text into a buffer in the firmware
-        self._copy_buffer(text)
+        # Copy the text into a buffer in the firmware, then display the buffer
+        # as a long string
+        self._display_buffer(text, SendCommand.DISPLAY_SMALL_TEXT)
+
+
+class AsyncHat(Hat):
+    """
+    A Hat whose SPI traffic is sent by a background worker thread, so the caller
+    never waits on the bus (or on a display upload). Commands are queued by
+    priority:
+
+    - Servo setpoints are latest-wins: a setpoint that hasn't been sent yet is
+      replaced by a newer one instead of queueing up behind it.
+    - Other control commands (servo enable/disable) keep their order relative
+      to the setpoints.
+    - Display updates are low priority and sent one frame at a time, only when
+      no control command is waiting, so a servo frame waits for at most one
+      display frame. The frames of a screen are spaced like a batched transfer
+      (batch_frame_gap_us). A screen that hasn't started uploading yet is
+      replaced by a newer one.
+
+    The worker waits out the gap the previous frame needs before it picks the
+    next one, so a setpoint queued during that wait still goes first.
+
+    Buttons and the joystick are published from the reply to every frame, and
+    the worker polls them with NOOPs while the queue is idle.
+
+    Call start() after open() (and after any autotune_spi_speed) to hand the
+    bus to the worker. Until then it behaves exactly like a Hat.
+    """
 
-        # After sending copying to the fw buffer, display the buffer as a long string
-        self.transceive(pad(SendCommand.DISPLAY_SMALL_TEXT))
+    def __init__(self, *args, poll_interval=0.02, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.poll_interval = poll_interval
+        self.queued = threading.Condition()
+        self.control = deque()  # Packets to send before any display frame
+        self.next_display = None  # Frames of a screen waiting to be uploaded
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._worker, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Send everything still queued, then give the bus back to the caller."""
+        if self.thread is not None:
+            with self.queued:
+                self.running = False
+                self.queued.notify()
+            self.thread.join(timeout=2.0)
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        super().close()
+
+    def transceive(self, packet):
+        if self.thread is None:
+            return super().transceive(packet)
+
+        command = int(packet[0]) & 0xFF
+        if command == SendCommand.NOOP:
+            return  # The worker keeps the buttons up to date
+
+        with self.queued:
+            last = self.control[-1] if self.control else None
+            # Copy, the packet is usually one of the reused encode buffers
+            packet = bytes(packet)
+            if command == SendCommand.SET_SERVOS and last is not None:
+                if last[0] == SendCommand.SET_SERVOS:
+                    self.control[-1] = packet  # Latest setpoint wins
+                    return
+            self.control.append(packet)
+            self.queued.notify()
+
+    def transceive_batch(self, frames: bytes) -> List[List[int]]:
+        if self.thread is None:
+            return super().transceive_batch(frames)
+
+        with self.queued:
+            self.next_display = frames
+            self.queued.notify()
+        return []
+
+    def _update_buttons(self, reply, offset=0):
+        # Swap in a new object so readers on other threads never see a half
+        # updated one
+        menu, joy, joy_x, joy_y = _REPLY.unpack_from(reply, offset)
+        self.buttons = Buttons(menu == 1, joy == 1, joy_x / 100, joy_y / 100)
+
+    def _worker(self):
+        noop = _COMMAND.pack(SendCommand.NOOP, 0)
+        frames = deque()  # What's left of the screen being uploaded
+
+        while True:
+            self._wait_until_ready()
+            with self.queued:
+                if not (self.control or frames or self.next_display):
+                    if not self.running:
+                        break
+                    self.queued.wait(self.poll_interval)
+
+                display = False
+                if self.control:
+                    packet = self.control.popleft()
+                elif frames:
+                    packet, display = frames.popleft(), True
+                elif self.next_display is not None:
+                    upload, self.next_display = self.next_display, None
+                    frames.extend(upload[i : i + 8] for i in range(0, len(upload), 8))
+                    packet, display = frames.popleft(), True
+                else:
+                    packet = noop  # Idle, poll the buttons
+
+            try:
+                Hat.transceive(self, packet)
+            except Exception as e:
+                log.warning(f"Hat transfer failed: {e}")
+            if display and frames:
+                # Within a screen, as in transceive_batch (the last frame, the
+                # display command, keeps its own gap)
+                gap = self.batch_frame_gap_us * 1e-6
+                self.ready_time = time.monotonic() + gap
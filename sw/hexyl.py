@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
 import time
+import threading
 import numpy as np
 import itertools
 from operator import add
-from typing import Union, List, Tuple, Dict
+from typing import Union, List, Tuple, Dict, Optional
 
 
 class color:
@@ -21,152 +22,319 @@ class color:
     end = "\033[0m"
 
 
-def hexyl():
-    tick = 0
+# One recorded transfer in a trace file. A trace file is just these records back
+# to back, read it with load_trace().
+TRACE_DTYPE = np.dtype([("time_ns", "<i8"), ("tx", "u1", 8), ("rx", "u1", 8)])
 
-    def wrapstr(c: Union[str, None], s):
-        if c is None:
-            return s
-        else:
-            return c + s + color.end
-
-    def wrap_tx(c: Union[str, None], s):
-        # first byte like 31 to string 0x1F
-        byte = f"{np.uint8(s):02x}"
-        if byte == "00":
-            c = color.darkgray
-        if c is None:
-            return byte
-        else:
-            return c + byte + color.end
 
-    def enum_bytes_tx(bytelist, c: Dict):
-        for i, v in enumerate(bytelist):
-            yield wrap_tx(c.get(i), v)
+def load_trace(filename: str) -> np.ndarray:
+    return np.fromfile(filename, dtype=TRACE_DTYPE)
 
-    def wrap_rx(clr: Union[str, None], the_byte, position):
-        # first byte like 31 to string 0x1F
-        byte_str = f"{np.uint8(the_byte):02x}"
 
-        # first two bytes are buttons
-        # second two bytes are joystick
-        # last four bytes should always be zero
+def reply_ok(rx) -> bool:
+    """
+    Check the invariants of an 8 byte reply from the hat: the first two bytes
+    are buttons (0 or 1), the next two the joystick (-100 to +100 as int8) and
+    the last four are always zero.
+    """
+    if len(rx) != 8:
+        return False
+    rx = [b & 0xFF for b in rx]
+    joy_x, joy_y = [b - 256 if b > 127 else b for b in rx[2:4]]
+    return (
+        rx[0] <= 0x01
+        and rx[1] <= 0x01
+        and sum(rx[4:8]) == 0
+        and abs(joy_x) <= 100
+        and abs(joy_y) <= 100
+    )
 
-        # unused bytes
-        if position > 3:
-            if byte_str == "00":  # nominal
-                clr = color.darkgray
-            else:
-                clr = color.danger
 
-        if position <= 1:
-            if byte_str == "00":  # nominal
-                clr = color.darkgray
+def _wrapstr(c: Union[str, None], s):
+    if c is None:
+        return s
+    else:
+        return c + s + color.end
 
-        if clr is None:
-            clr = color.darkgray
 
-        return clr + byte_str + color.end
+def _wrap_tx(c: Union[str, None], s):
+    # first byte like 31 to string 0x1F
+    byte = f"{s & 0xFF:02x}"
+    if byte == "00":
+        c = color.darkgray
+    if c is None:
+        return byte
+    else:
+        return c + byte + color.end
 
-    def enum_bytes_rx(bytelist, c: Dict):
-        for i, v in enumerate(bytelist):
-            yield wrap_rx(c.get(i), v, i)
 
-    def tx_list(l):
-        if np.uint8(l[0]) == 0x80:
-            c = {0: color.green}
-            c.update({k: color.yellow for k in range(1, 9)})
-        else:
-            c = {0: color.red}
+def _enum_bytes_tx(bytelist, c: Dict):
+    for i, v in enumerate(bytelist):
+        yield _wrap_tx(c.get(i), v)
 
-        return " ".join(enum_bytes_tx(l, c))
 
-    def printable(c):
-        if c > 0x1F & c < 0x7F:
-            return chr(c)
-        if c == 0x0A:
-            return "¶"
-        else:
-            return "·"
-
-    def tx_to_english(l):
-        b1 = np.uint8(l[0])
-        if b1 == 0x80:
-            remainder = l[1:]
-            return " ┊ " + color.string + "".join(map(printable, remainder)) + color.end
-        elif b1 == 0x01:
-            return " ┊ " + wrapstr(color.red, "servos: on")
-        elif b1 == 0x02:
-            return " ┊ " + wrapstr(color.red, "servos: off")
-        elif b1 == 0x05:
-            s1 = ((l[1] << 8) + l[2]) / 100
-            s2 = ((l[3] << 8) + l[4]) / 100
-            s3 = ((l[5] << 8) + l[6]) / 100
-
-            s = f"{s1:6.2f}, {s2:6.2f}, {s3:6.2f}"
-            return " ┊ " + wrapstr(color.servos, s)
-        elif b1 == 0x06:
-            return " ┊ " + wrapstr(color.green, "text/icon")
-        elif b1 >= 0x81 and b1 <= 0x85:
-            return " ┊ " + wrapstr(color.string_cmd, "◊")
-        else:
-            return ""
-
-    def rx_list(l):
-        c = {0: color.green, 1: color.green, 2: color.cyan, 3: color.cyan}
-        return " ".join(enum_bytes_rx(l, c))
-
-    def canary(l):
-        if (
-            np.uint8(l[0]) > 0x01
-            or np.uint(l[1]) > 0x01
-            or sum(np.uint(l[4:8])) > 0
-            or abs(np.int8(l[2])) > 100
-            or abs(np.int8(l[3]) > 100)
-        ):
-            return wrapstr(color.red, " FATAL")
+def _wrap_rx(clr: Union[str, None], the_byte, position):
+    # first byte like 31 to string 0x1F
+    byte_str = f"{the_byte & 0xFF:02x}"
+
+    # first two bytes are buttons
+    # second two bytes are joystick
+    # last four bytes should always be zero
+
+    # unused bytes
+    if position > 3:
+        if byte_str == "00":  # nominal
+            clr = color.darkgray
         else:
-            return ""
+            clr = color.danger
 
-    # verbosity spi debug
-    # 0: nothing
-    # 1: mode changes
-    # 2: include servo settings (0x05)
-    # 3: include noops (0x00) (useful to show menu/joystick state)
+    if position <= 1:
+        if byte_str == "00":  # nominal
+            clr = color.darkgray
 
-    def hfn(tx, rx, verbose=0):
-        nonlocal tick
-        tick = tick + 1
+    if clr is None:
+        clr = color.darkgray
+
+    return clr + byte_str + color.end
+
+
+def _enum_bytes_rx(bytelist, c: Dict):
+    for i, v in enumerate(bytelist):
+        yield _wrap_rx(c.get(i), v, i)
+
+
+def _tx_list(l):
+    if l[0] & 0xFF == 0x80:
+        c = {0: color.green}
+        c.update({k: color.yellow for k in range(1, 9)})
+    else:
+        c = {0: color.red}
+
+    return " ".join(_enum_bytes_tx(l, c))
 
-        if verbose == 0:
-            return
 
-        if np.uint8(tx[0]) == 0x05 and verbose < 2:
-            return
+def _printable(c):
+    if c > 0x1F & c < 0x7F:
+        return chr(c)
+    if c == 0x0A:
+        return "¶"
+    else:
+        return "·"
 
-        if np.uint8(tx[0]) == 0x00 and verbose < 3:
-            return
 
-        # Print a 5-digit tick that updates every 30 Hz
-        print(f"{color.gray}{tick:05d}{color.end}", end="")
-        print(" ┊ ", end="")
+def _tx_to_english(l):
+    b1 = l[0] & 0xFF
+    if b1 == 0x80:
+        remainder = l[1:]
+        return " ┊ " + color.string + "".join(map(_printable, remainder)) + color.end
+    elif b1 == 0x01:
+        return " ┊ " + _wrapstr(color.red, "servos: on")
+    elif b1 == 0x02:
+        return " ┊ " + _wrapstr(color.red, "servos: off")
+    elif b1 == 0x05:
+        s1 = ((l[1] << 8) + l[2]) / 100
+        s2 = ((l[3] << 8) + l[4]) / 100
+        s3 = ((l[5] << 8) + l[6]) / 100
 
-        # Tx 8 bytes: transmit to Hat
-        print(tx_list(tx), end="")
-        print(" ┊ ", end="")
+        s = f"{s1:6.2f}, {s2:6.2f}, {s3:6.2f}"
+        return " ┊ " + _wrapstr(color.servos, s)
+    elif b1 == 0x06:
+        return " ┊ " + _wrapstr(color.green, "text/icon")
+    elif b1 >= 0x81 and b1 <= 0x85:
+        return " ┊ " + _wrapstr(color.string_cmd, "◊")
+    else:
+        return ""
 
-        # Rx 8 bytes: receive bytes back from Hat
-        print(rx_list(rx), end="")
 
-        # Translate some of the bytes
-        print(tx_to_english(tx), end="")
+def _rx_list(l):
+    c = {0: color.green, 1: color.green, 2: color.cyan, 3: color.cyan}
+    return " ".join(_enum_bytes_rx(l, c))
 
-        # Scan for unusual bytes
-        print(canary(rx))
+
+def _canary(l):
+    if not reply_ok(l):
+        return _wrapstr(color.red, " FATAL")
+    else:
+        return ""
+
+
+# verbosity spi debug
+# 0: nothing
+# 1: mode changes
+# 2: include servo settings (0x05)
+# 3: include noops (0x00) (useful to show menu/joystick state)
+
+
+def visible(command: int, verbose=0) -> bool:
+    """Whether a transfer starting with `command` is shown at `verbose`."""
+    command &= 0xFF
+    if verbose == 0:
+        return False
+    if command == 0x05 and verbose < 2:
+        return False
+    if command == 0x00 and verbose < 3:
+        return False
+    return True
+
+
+def render(tick: int, tx, rx, dt_ms: Optional[float] = None) -> str:
+    """One colored line for a transfer, optionally with the ms since the last."""
+    # A 5-digit tick that updates every 30 Hz
+    line = f"{color.gray}{tick:05d}{color.end}"
+    if dt_ms is not None:
+        line += f" {color.gray}{dt_ms:7.2f}ms{color.end}"
+
+    # Tx 8 bytes: transmit to Hat
+    # Rx 8 bytes: receive bytes back from Hat
+    line += " ┊ " + _tx_list(tx) + " ┊ " + _rx_list(rx)
+
+    # Translate some of the bytes, and scan for unusual bytes
+    return line + _tx_to_english(tx) + _canary(rx)
+
+
+def hexyl():
+    tick = 0
+
+    def hfn(tx, rx, verbose=0):
+        nonlocal tick
+        tick = tick + 1
+
+        if visible(tx[0], verbose):
+            print(render(tick, tx, rx))
 
     return hfn
 
 
+class SpiRecorder:
+    """
+    Records every SPI transfer (timestamp, tx and rx bytes) into a preallocated
+    ring, which costs a couple of small copies. Filtering by verbosity and
+    rendering to colored text only happen when the recording is read: on demand
+    with lines(), or by a printer thread started with start().
+
+    With a `trace_file` the same thread also appends the raw transfers to that
+    file (see TRACE_DTYPE), for replaying with fakespi.FakeSpiDev.
+
+    If the reader falls more than `capacity` transfers behind, the oldest ones
+    are lost (and counted in `dropped`).
+    """
+
+    def __init__(self, capacity=4096, verbose=0, interval=0.1, trace_file=None):
+        self.capacity = capacity
+        self.verbose = verbose
+        self.interval = interval
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.frames = bytearray(capacity * 16)  # tx then rx, 16 bytes a transfer
+        self.count = 0  # Transfers recorded so far (the tick)
+        self.printed = 0  # Transfers the printer thread has gone through
+        self.saved = 0  # Transfers written to the trace file
+        self.dropped = 0
+        self.thread = None
+        self.running = threading.Event()
+
+        self.trace_file = trace_file
+        self.trace = None
+        if trace_file:
+            open(trace_file, "wb").close()  # Start a new trace
+
+    def record(self, tx, rx):
+        slot = self.count % self.capacity
+        self.times[slot] = time.monotonic_ns()
+        offset = 16 * slot
+        self.frames[offset : offset + 8] = tx
+        self.frames[offset + 8 : offset + 16] = rx
+        self.count += 1
+
+    def __call__(self, tx, rx, verbose=None):
+        # Drop in for the hexyl() printer
+        self.record(tx, rx)
+
+    def records(self, start=0, stop=None) -> np.ndarray:
+        """The transfers recorded from tick `start` up to `stop`, as TRACE_DTYPE."""
+        stop = self.count if stop is None else stop
+        if stop - start > self.capacity:
+            self.dropped += stop - start - self.capacity
+            start = stop - self.capacity
+
+        ticks = np.arange(start, stop)
+        slots = ticks % self.capacity
+        frames = np.frombuffer(self.frames, dtype=np.uint8).reshape(-1, 16)
+        records = np.empty(len(ticks), dtype=TRACE_DTYPE)
+        records["time_ns"] = self.times[slots]
+        records["tx"] = frames[slots, :8]
+        records["rx"] = frames[slots, 8:]
+
+        # Leave out any overwritten while we were reading them
+        return records[ticks + self.capacity >= self.count]
+
+    def lines(self, start=0, stop=None) -> Tuple[int, List[str]]:
+        """
+        Render the visible transfers recorded from tick `start` (0 based) up to
+        `stop`. Returns the tick to continue from and the lines.
+        """
+        stop = self.count if stop is None else stop
+        if stop - start > self.capacity:
+            self.dropped += stop - start - self.capacity
+            start = stop - self.capacity
+
+        lines = []
+        for tick in range(start, stop):
+            slot = tick % self.capacity
+            offset = 16 * slot
+            tx = self.frames[offset : offset + 8]
+            rx = self.frames[offset + 8 : offset + 16]
+
+            # Time since the transfer before, whether or not that one is shown
+            dt_ms = 0.0
+            if tick > 0:
+                previous = self.times[(tick - 1) % self.capacity]
+                dt_ms = (int(self.times[slot]) - int(previous)) / 1e6
+
+            if tick + self.capacity < self.count:
+                continue  # Overwritten while we were reading it
+
+            if visible(tx[0], self.verbose):
+                lines.append(render(tick + 1, tx, rx, dt_ms))
+        return stop, lines
+
+    def flush(self):
+        """Print (and save) everything recorded since the last flush."""
+        stop = self.count
+        if self.trace is not None:
+            self.trace.write(self.records(self.saved, stop).tobytes())
+            self.saved = stop
+
+        if self.verbose:
+            self.printed, lines = self.lines(self.printed, stop)
+            for line in lines:
+                print(line)
+        else:
+            self.printed = stop
+
+    def start(self):
+        if self.trace_file and self.trace is None:
+            self.trace = open(self.trace_file, "ab")
+        if self.thread is None:
+            self.running.set()
+            self.thread = threading.Thread(target=self._printer, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.running.clear()
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        self.flush()
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def _printer(self):
+        while self.running.is_set():
+            time.sleep(self.interval)
+            self.flush()
+
+
 def main():
     tx1 = [0x05, 0x32, 0x5F, 0x2C, 0x64, 0x35, 0x62, 0x00]
 
@@ -3,6 +3,7 @@
 
 import math
 import cython
+import numpy as np
 
 cdef float _bandpass_lookup[256]
 cdef float _last_sigma = 0.0
@@ -85,3 +86,60 @@ def hue_mask(unsigned char [:, :, :] image, unsigned char center, float sigma, f
 
     # return the thresholded image
     return image
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def hue_mask_gray(
+    unsigned char [:, :, ::1] image,
+    unsigned char center,
+    float sigma,
+    float gain,
+    float mask_gain,
+    unsigned char threshold=0,
+    unsigned char [:, ::1] out=None,
+):
+    """
+    Single channel version of hue_mask. Leaves the hsv image untouched and
+    writes the mask into `out` (allocated if not given), one byte per pixel.
+
+    If `threshold` is non-zero the mask is binarized in the same pass: pixels
+    whose mask value is >= threshold become 255, everything else 0. This is
+    equivalent to running cv2.inRange on the output of hue_mask.
+    """
+    global _bandpass_lookup
+
+    cdef int x, y, n, width, height
+    cdef float f
+    cdef float lookup[256]
+    cdef unsigned char mask
+
+    height = image.shape[0]
+    width = image.shape[1]
+
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+
+    # generate a lookup table for center, sigma & gain
+    if (center != _last_center or sigma != _last_sigma or gain != _last_gain):
+        _update_bandpass_lookup(center, sigma, gain)
+
+    # fold the mask gain and the [0..255] scaling of s, v & the output into
+    # the table so each pixel is a lookup and two multiplies
+    for n in range(256):
+        lookup[n] = _bandpass_lookup[n] * mask_gain / (255.0 * 255.0) * 255.0
+
+    with nogil:
+        for y in range(0, height):
+            for x in range(0, width):
+                f = lookup[image[y, x, 0]] * image[y, x, 1] * image[y, x, 2]
+                if f > 255.0:
+                    f = 255.0
+
+                # covert to char space (optionally thresholded)
+                mask = <unsigned char>f
+                if threshold != 0:
+                    mask = 255 if mask >= threshold else 0
+                out[y, x] = mask
+
+    return np.asarray(out)
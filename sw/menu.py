@@ -18,8 +18,9 @@ from hat import Icon
 from enum import Enum
 from env import MoabEnv
 from functools import partial
-from log_csv import log_decorator
+from telemetry import telemetry_decorator
 from settings import get_settings
+from common import KalmanEstimator
 from dataclasses import dataclass
 from calibrate import calibrate_controller
 from typing import Callable, Any, Union, Optional, List
@@ -33,6 +34,8 @@ from controllers import (
     pid_controller,
     zero_controller,
     brain_controller,
+    async_brain_controller,
+    policy_controller,
     joystick_controller,
     dump_ball_controller,
     kiosk_mode_decorator,
@@ -81,8 +84,18 @@ def squash_small_angles(controller_fn, min_angle=1.0):
     return decorated_controller
 
 
-def build_menu(env, log_on, logfile, kiosk, kiosk_timeout, kiosk_clock_position):
-    log_csv = lambda fn: log_decorator(fn, logfile)
+def build_menu(
+    env,
+    log_on,
+    logfile,
+    kiosk,
+    kiosk_timeout,
+    kiosk_clock_position,
+    brain_fn=brain_controller,
+    policies=(),
+    log_responses=False,
+):
+    log_telemetry = lambda fn: telemetry_decorator(fn, logfile, responses=log_responses)
 
     # fmt: off
     top_menu = [
@@ -100,21 +113,22 @@ def build_menu(env, log_on, logfile, kiosk, kiosk_timeout, kiosk_clock_position)
             name="Joystick",
             closure=joystick_controller,
             kwargs={},
-            decorators=[squash_small_angles, log_csv] if log_on else [squash_small_angles],
+            decorators=[squash_small_angles, log_telemetry] if log_on else [squash_small_angles],
         ),
         MenuOption(
             name="PID",
             closure=pid_controller,
             kwargs={},
-            decorators=[log_csv] if log_on else None,
+            decorators=[log_telemetry] if log_on else None,
         ),
     ]
     # fmt: on
 
     # Parse the docker-compose.yml file for a list of brains
     middle_menu = []
-    # Parse brains from docker ps and add to middle_menu
-    for brain_image in docker.ps():
+    # Add the brains running in docker to middle_menu (cached, so a refresh
+    # only asks docker what changed)
+    for brain_image in docker.brains():
         if kiosk:  # Kiosk-ify brains if kiosk mode is enabled
             m = MenuOption(
                 name=brain_image.short_name,
@@ -123,19 +137,45 @@ def build_menu(env, log_on, logfile, kiosk, kiosk_timeout, kiosk_clock_position)
                     "env": env,
                     "timeout": kiosk_timeout,
                     "dump_location_clock_hand": kiosk_clock_position,
-                    "controller": brain_controller,
+                    "controller": brain_fn,
                     "controller_kwargs": {
                         "port": brain_image.port, "alert_fn": alert_callback
                     },
                 },
-                decorators=[log_csv] if log_on else None,
+                decorators=[log_telemetry] if log_on else None,
             )
         else:
             m = MenuOption(
                 name=brain_image.short_name,
-                closure=brain_controller,
+                closure=brain_fn,
                 kwargs={"port": brain_image.port, "alert_fn": alert_callback},
-                decorators=[log_csv] if log_on else None,
+                decorators=[log_telemetry] if log_on else None,
+            )
+        middle_menu.append(m)
+
+    # Exported brains run in-process
+    for policy_file in policies:
+        # Like the brains' short names, fit the name on the display
+        name = os.path.splitext(os.path.basename(policy_file))[0][:9]
+        if kiosk:
+            m = MenuOption(
+                name=name,
+                closure=kiosk_mode_decorator,
+                kwargs={
+                    "env": env,
+                    "timeout": kiosk_timeout,
+                    "dump_location_clock_hand": kiosk_clock_position,
+                    "controller": policy_controller,
+                    "controller_kwargs": {"policy_file": policy_file},
+                },
+                decorators=[log_telemetry] if log_on else None,
+            )
+        else:
+            m = MenuOption(
+                name=name,
+                closure=policy_controller,
+                kwargs={"policy_file": policy_file},
+                decorators=[log_telemetry] if log_on else None,
             )
         middle_menu.append(m)
 
@@ -176,7 +216,6 @@ def kiosk_mode(env, dump_location_clock_hand):
     for _ in range(env.frequency * 1):
         action, _ = dump_ball_fn((state, detected, buttons))
         state, detected, buttons = env.step(action)
-        time.sleep(1 / env.frequency)
 
         if buttons.menu_button:
             return (state, detected, buttons), True
@@ -195,7 +234,6 @@ def kiosk_mode(env, dump_location_clock_hand):
     while detected_count < 3:
         action, _ = zero_fn((state, detected, buttons))
         state, detected, buttons = env.step(action)
-        time.sleep(1 / env.frequency)
 
         if detected:
             detected_count += 1
@@ -234,6 +272,33 @@ def _handle_debug(ctx, param, debug):
 
 @click.command()
 @click.version_option(version="3.3.0")
+@click.option(
+    "--async-brain/--no-async-brain",
+    default=False,
+    help="Don't wait for brains, use their latest action (see --brain-staleness)",
+    show_default=True,
+)
+@click.option(
+    "-a",
+    "--async-hat/--no-async-hat",
+    default=False,
+    help="Send SPI traffic to the hat from a background thread",
+    show_default=True,
+)
+@click.option(
+    "--brain-fallback",
+    type=click.Choice(["level", "pid"]),
+    default="level",
+    help="With --async-brain, the action when the brain's is too stale",
+    show_default=True,
+)
+@click.option(
+    "--brain-staleness",
+    type=float,
+    default=0.2,
+    help="With --async-brain, seconds before a brain's action is too stale",
+    show_default=True,
+)
 @click.option(
     "-c",
     "--cont",
@@ -248,11 +313,21 @@ def _handle_debug(ctx, param, debug):
     default=True,
     help="programmer details showing Tx/Rx buffers",
 )
+@click.option(
+    "--estimator",
+    type=click.Choice(["derivative", "kalman"]),
+    default="derivative",
+    help="Ball velocity from the position derivative or a Kalman filter",
+    show_default=True,
+)
 @click.option(
     "-f",
     "--file",
-    default="/tmp/log.csv",
-    help=("If --log, then save CSV to this file"),
+    default="/tmp/log.bin",
+    help=(
+        "If --log, then save telemetry to this file (see telemetry.py for CSV). "
+        "Brain responses are only kept on errors, see --log-responses"
+    ),
     type=click.Path(
         exists=False,
         dir_okay=False,
@@ -268,13 +343,66 @@ def _handle_debug(ctx, param, debug):
     help="Frequency of controller in Hz",
     show_default=True,
 )
+@click.option(
+    "--localization",
+    type=click.Choice(["circle", "moments"]),
+    default="circle",
+    help="Ball center from its enclosing circle or (sub-pixel) mask moments",
+    show_default=True,
+)
 @click.option(
     "-l",
     "--log/--no-log",
     default=True,
     help=("Enables or disables the logging as specified by -f/--file"),
 )
+@click.option(
+    "--log-responses/--no-log-responses",
+    default=False,
+    help="If --log, keep every brain response, not only the errors",
+    show_default=True,
+)
+@click.option(
+    "-p",
+    "--pipelined/--no-pipelined",
+    default=False,
+    help="Capture camera frames on a background thread",
+    show_default=True,
+)
+@click.option(
+    "--policy",
+    multiple=True,
+    help="Add a menu entry running this exported brain policy (.onnx or .npz)",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--profile/--no-profile",
+    default=False,
+    help="Log rolling p50/p95/p99 latencies of each control loop phase",
+    show_default=True,
+)
 @click.option("-r", "--reset/--no-reset", help="Reset Moab firmware on start")
+@click.option(
+    "-s",
+    "--stream",
+    type=click.Choice(["file", "shm"]),
+    default="file",
+    help="How debug frames reach the stream service (shm: view /shm.html)",
+    show_default=True,
+)
+@click.option(
+    "--trace",
+    default=None,
+    help="Save every SPI transfer to this file (replay with tests/spi_bench.py)",
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click.option(
+    "-t",
+    "--tracking/--no-tracking",
+    default=False,
+    help="Only search for the ball near where it was last seen",
+    show_default=True,
+)
 @click.option(
     "-v",
     "--verbose",
@@ -292,12 +420,25 @@ def main(ctx: click.core.Context, **kwargs: Any) -> None:
 
 
 def main_menu(
+    async_brain,
+    async_hat,
+    brain_fallback,
+    brain_staleness,
     cont,
     debug,
+    estimator,
     file,
     hertz,
+    localization,
     log,
+    log_responses,
+    pipelined,
+    policy,
+    profile,
     reset,
+    stream,
+    trace,
+    tracking,
     verbose,
 ):
 
@@ -314,20 +455,48 @@ def main_menu(
     servo_safety_timeout = settings["servo_safety_timeout"]
     servo_safety_clock_position = settings["servo_safety_clock_position"]
 
-
-    with MoabEnv(hertz, debug=debug, verbose=verbose) as env:
-        menu_list = build_menu(env, log, file, kiosk, kiosk_timeout, kiosk_clock_position)
+    # Brains either block the control loop or run alongside it
+    brain_fn = brain_controller
+    if async_brain:
+        brain_fn = partial(
+            async_brain_controller,
+            max_staleness=brain_staleness,
+            fallback=brain_fallback,
+        )
+
+    with MoabEnv(
+        hertz,
+        debug=debug,
+        verbose=verbose,
+        pipelined_camera=pipelined,
+        tracking_detector=tracking,
+        localization=localization,
+        estimator_fn=KalmanEstimator if estimator == "kalman" else None,
+        stream_transport=stream,
+        profile=profile,
+        async_hat=async_hat,
+        trace_file=trace,
+    ) as env:
+        menu_list = build_menu(
+            env,
+            log,
+            file,
+            kiosk,
+            kiosk_timeout,
+            kiosk_clock_position,
+            brain_fn,
+            policy,
+            log_responses,
+        )
 
         if cont == -1:
             # normal startup state
             current = MenuState.first_level
             index = 0
-            last_index = -1
         else:
             # CLI argument to start in one of the controllers
             current = MenuState.second_level
             index = cont
-            last_index = -1
 
         # Default menu raises the plate to alert the user the system is ready
         if cont == -1:
@@ -337,7 +506,7 @@ def main_menu(
             env.hardware.disable_servos()
 
         while True:
-            time.sleep(1 / env.frequency)
+            env.scheduler.wait()
 
             # In the first level of the menu (select between menu options)
             if current == MenuState.first_level:
@@ -349,10 +518,8 @@ def main_menu(
                 else:
                     icon = Icon.UP_DOWN
 
-                # Only update text and icon if it has changed
-                if last_index != index:
-                    env.hardware.display(menu_list[index].name, icon)
-                    last_index = index
+                # The hat skips the upload if the text and icon haven't changed
+                env.hardware.display(menu_list[index].name, icon)
 
                 buttons = env.hardware.get_buttons()
                 if buttons.joy_button:  # Enter the menu option
@@ -371,6 +538,9 @@ def main_menu(
                             kiosk,
                             kiosk_timeout,
                             kiosk_clock_position,
+                            brain_fn,
+                            policy,
+                            log_responses,
                         )
                         env.hardware.display("Refreshing", icon.BLANK)
                         time.sleep(0.5)
@@ -407,11 +577,13 @@ def main_menu(
 
                 if menu_list[index].is_controller:
                     controller_start_time = time.time()
+                    env.scheduler.reset()
 
                     # If it's a controller run the control loop
                     try:
                         while not buttons.menu_button:
-                            action, info = controller((state, detected, buttons))
+                            with env.scheduler.phase("controller"):
+                                action, info = controller((state, detected, buttons))
                             state, detected, buttons = env.step(action)
 
                             # If the controller has been running for more than
@@ -435,6 +607,7 @@ def main_menu(
                     except BrainNotFound:
                         print(f"caught BrainNotFound in loop")
 
+                    env.scheduler.report()
                     env.hardware.go_up()
                 else:
                     # If not a controller, let it do it's own thing. We assume
@@ -443,7 +616,6 @@ def main_menu(
 
                 # Loop breaks after menu pressed and puts the plate back to go_up
                 current = MenuState.first_level
-                last_index = -1
 
                 if menu_list[index].require_servos:
                     env.hardware.disable_servos()
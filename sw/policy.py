@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Exported brain policies, evaluated in-process
+
+A policy maps the observation (ball_x, ball_y, ball_vel_x, ball_vel_y) to the
+brain's action (input_pitch, input_roll), each in [-1, 1].
+"""
+
+import os
+import numpy as np
+
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0.0, out=x),
+    "linear": lambda x: x,
+}
+
+
+class NumpyPolicy:
+    """
+    A multilayer perceptron from an .npz file with the arrays `weights_0`,
+    `bias_0`, `weights_1`, `bias_1`... (weights are inputs x outputs). Optional
+    entries: `obs_mean` & `obs_std` to normalize the observation, and
+    `activation` & `output_activation` (default tanh for both).
+    """
+
+    def __init__(self, filename):
+        with np.load(filename) as npz:
+            layers = []
+            while f"weights_{len(layers)}" in npz:
+                n = len(layers)
+                weights = npz[f"weights_{n}"].astype(np.float64)
+                bias = npz[f"bias_{n}"].astype(np.float64)
+                layers.append((weights, bias))
+            if not layers:
+                raise ValueError(f"No weights_0 in policy {filename}")
+
+            inputs = layers[0][0].shape[0]
+            self.obs_mean = npz["obs_mean"] if "obs_mean" in npz else np.zeros(inputs)
+            self.obs_std = npz["obs_std"] if "obs_std" in npz else np.ones(inputs)
+            activation = str(npz["activation"]) if "activation" in npz else "tanh"
+            output = (
+                str(npz["output_activation"]) if "output_activation" in npz else "tanh"
+            )
+
+        self.layers = layers
+        self.activation = ACTIVATIONS[activation]
+        self.output_activation = ACTIVATIONS[output]
+
+    def __call__(self, observation) -> np.ndarray:
+        x = (np.asarray(observation, dtype=np.float64) - self.obs_mean) / self.obs_std
+        for weights, bias in self.layers[:-1]:
+            x = self.activation(x @ weights + bias)
+        weights, bias = self.layers[-1]
+        return self.output_activation(x @ weights + bias)
+
+
+class OnnxPolicy:
+    """
+    An ONNX model with one input of shape (1, 4) (or (4,)) and the action as
+    the first two values of its first output. Needs onnxruntime.
+    """
+
+    def __init__(self, filename):
+        # Imported here, it's slow to load and only needed for .onnx policies
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(f"onnxruntime is needed to run the policy {filename}")
+
+        options = onnxruntime.SessionOptions()
+        # One observation at a time, threads only add overhead
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            filename, options, providers=["CPUExecutionProvider"]
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input = np.zeros((1, 4), dtype=np.float32)
+        if len(model_input.shape) == 1:
+            self.input = self.input[0]
+
+    def __call__(self, observation) -> np.ndarray:
+        self.input.flat[:] = observation
+        outputs = self.session.run(None, {self.input_name: self.input})
+        return np.ravel(outputs[0])[:2]
+
+
+def load_policy(filename):
+    """A NumpyPolicy or OnnxPolicy, by the extension of `filename`."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".npz":
+        return NumpyPolicy(filename)
+    elif extension == ".onnx":
+        return OnnxPolicy(filename)
+    else:
+        raise ValueError(f"Unknown policy format {extension!r} (.npz or .onnx)")
@@ -0,0 +1,78 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Rolling latency statistics for the phases of a control tick
+"""
+
+import time
+import numpy as np
+import logging as log
+
+from contextlib import contextmanager
+from typing import Dict
+
+
+class LatencyProfiler:
+    """
+    Records nanosecond durations per named phase into fixed size rolling
+    windows and summarizes them as p50/p95/p99. Recording is an array write;
+    percentiles are only computed when asked for (or when logging).
+    """
+
+    def __init__(self, window=300, log_interval=10.0):
+        self.window = window
+        self.log_interval = log_interval
+        self.samples: Dict[str, np.ndarray] = {}
+        self.counts: Dict[str, int] = {}
+        self.next_log = time.monotonic() + log_interval
+
+    def reset(self):
+        self.samples.clear()
+        self.counts.clear()
+
+    def record(self, name: str, duration_ns: int):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = np.zeros(self.window, dtype=np.int64)
+            self.counts[name] = 0
+
+        samples[self.counts[name] % self.window] = duration_ns
+        self.counts[name] += 1
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the body of the `with` block as phase `name`."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter_ns() - start)
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95/p99 in milliseconds over the window of each phase."""
+        stats = {}
+        for name, samples in self.samples.items():
+            count = self.counts[name]
+            filled = samples[: min(count, self.window)]
+            p50, p95, p99 = np.percentile(filled, (50, 95, 99))
+            stats[name] = {
+                "count": count,
+                "p50": p50 / 1e6,
+                "p95": p95 / 1e6,
+                "p99": p99 / 1e6,
+            }
+        return stats
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{name} {s['p50']:.2f}/{s['p95']:.2f}/{s['p99']:.2f}"
+            for name, s in self.percentiles().items()
+        )
+
+    def maybe_log(self):
+        """Log the summary if `log_interval` seconds have passed."""
+        now = time.monotonic()
+        if now >= self.next_log:
+            self.next_log = now + self.log_interval
+            log.info(f"Latency p50/p95/p99 (ms): {self.summary()}")
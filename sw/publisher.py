@@ -0,0 +1,124 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Publishes debug frames for the stream service without blocking the control loop
+"""
+
+import queue
+import threading
+import logging as log
+
+from time import monotonic
+from detector import save_img
+
+
+class FramePublisher:
+    """
+    Hands frames to a worker thread that JPEG encodes and writes them at a
+    lower rate than the control loop. Frames offered before the next publish
+    slot, or while the worker is still busy, are dropped rather than queued.
+
+    With transport="shm" raw frames are instead copied into a shared memory
+    ring (see stream/frame_ring.py), and only while the stream service reports
+    a connected viewer. The stream service does the JPEG encoding.
+    """
+
+    def __init__(
+        self,
+        filename="/tmp/camera/frame.jpg",
+        fps=10,
+        queue_size=2,
+        quality=80,
+        transport="file",
+    ):
+        if transport not in ("file", "shm"):
+            raise ValueError(f"Frame transport `{transport}` is not supported.")
+
+        self.transport = transport
+        self.ring = None
+        self.filename = filename
+        self.period = 1 / fps
+        self.quality = quality
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.next_publish = 0.0
+        self.dropped = 0
+        self.published = 0
+        self.thread = None
+
+    def start(self):
+        if self.transport == "shm" and self.ring is None:
+            # Imported here: the ring needs multiprocessing.shared_memory, which
+            # is new in Python 3.8 (Raspbian Buster has 3.7)
+            try:
+                from stream.frame_ring import FrameRing
+            except ImportError as e:
+                log.warning(
+                    f"Shared memory stream needs Python 3.8+ ({e}), using files"
+                )
+                self.transport = "file"
+            else:
+                self.ring = FrameRing.open()
+
+        if self.transport == "file" and self.thread is None:
+            self.thread = threading.Thread(target=self._worker, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.thread is not None:
+            # Wake up the worker so it can exit. Frames still queued are
+            # dropped to make room, a blocking put could wait on a full queue
+            while True:
+                try:
+                    self.frames.put_nowait(None)
+                    break
+                except queue.Full:
+                    try:
+                        self.frames.get_nowait()
+                    except queue.Empty:
+                        pass
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def publish(self, img) -> bool:
+        """
+        Offer a frame for publishing. Never blocks; returns whether the frame
+        was accepted.
+        """
+        now = monotonic()
+        if now < self.next_publish:
+            return False
+
+        if self.ring is not None:
+            # A plain memcpy, cheap enough to do inline
+            if not self.ring.viewer_active():
+                return False
+            self.ring.write(img)
+            self.published += 1
+            self.next_publish = now + self.period
+            return True
+
+        try:
+            # Copy so the caller is free to reuse its buffer
+            self.frames.put_nowait(img.copy())
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.next_publish = now + self.period
+        return True
+
+    def _worker(self):
+        while True:
+            img = self.frames.get()
+            if img is None:
+                break
+
+            try:
+                save_img(self.filename, img, rotated=False, quality=self.quality)
+                self.published += 1
+            except Exception as e:
+                log.warning(f"Could not publish frame: {e}")
@@ -0,0 +1,130 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Fixed rate scheduler for the control loop
+"""
+
+import time
+import numpy as np
+import logging as log
+
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+
+class RateScheduler:
+    """
+    Runs a loop at an exact period using absolute deadlines on the monotonic
+    clock. Time spent doing work is subtracted from the wait, and a tick that
+    overruns its deadline resyncs to the next one instead of trying to catch up
+    with a burst of short ticks.
+
+    Also keeps a histogram of wake up jitter (how late each tick started) and a
+    per-phase breakdown of where the time inside a tick went.
+
+    With realtime=False it never sleeps (ie for a simulation, which keeps its
+    own time) and only counts ticks and times phases.
+    """
+
+    def __init__(
+        self,
+        frequency=30,
+        jitter_bins_ms: Tuple[float, ...] = (0.1, 0.5, 1, 2, 5, 10),
+        profiler=None,
+        realtime=True,
+    ):
+        self.frequency = frequency
+        self.realtime = realtime
+        self.profiler = profiler  # Optional LatencyProfiler to forward phases to
+        self.period = 1 / frequency
+        self.jitter_bins_ms = jitter_bins_ms
+        self.reset()
+
+    def reset(self):
+        """Restart the deadlines and clear all statistics."""
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0
+        self.jitter_hist = np.zeros(len(self.jitter_bins_ms) + 1, dtype=np.int64)
+        # name -> [count, total seconds, max seconds]
+        self.phases: Dict[str, list] = {}
+
+    def wait(self) -> bool:
+        """
+        Sleep until the start of the next tick. Returns False if the previous
+        tick overran its deadline.
+        """
+        if not self.realtime:
+            self.ticks += 1
+            return True
+
+        now = time.monotonic()
+        if self.deadline is None:
+            self.deadline = now + self.period
+            return True
+
+        self.ticks += 1
+        target = self.deadline
+        on_time = now <= target
+        if on_time:
+            time.sleep(target - now)
+            now = time.monotonic()
+            self.deadline += self.period
+        else:
+            # Late: run this tick now, without sleeping, and realign to the
+            # first deadline after now. The deadlines missed in between are
+            # dropped rather than caught up on, the grid itself doesn't move.
+            self.overruns += 1
+            missed = int((now - target) / self.period) + 1
+            self.deadline += missed * self.period
+
+        late_ms = (now - target) * 1000
+        self.jitter_hist[np.searchsorted(self.jitter_bins_ms, late_ms)] += 1
+        return on_time
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the body of the `with` block as part of phase `name`."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed_ns = time.perf_counter_ns() - start
+            if self.profiler is not None:
+                self.profiler.record(name, elapsed_ns)
+
+            elapsed = elapsed_ns / 1e9
+            stats = self.phases.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def stats(self) -> dict:
+        edges = ["<" + str(b) for b in self.jitter_bins_ms]
+        edges.append(">=" + str(self.jitter_bins_ms[-1]))
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "jitter_ms": dict(zip(edges, self.jitter_hist.tolist())),
+            "phases_ms": {
+                name: {
+                    "mean": 1000 * total / count,
+                    "max": 1000 * max_time,
+                }
+                for name, (count, total, max_time) in self.phases.items()
+            },
+        }
+
+    def report(self):
+        """Log a summary of the statistics since the last reset."""
+        stats = self.stats()
+        log.info(
+            f"{self.frequency} Hz: {stats['ticks']} ticks, "
+            f"{stats['overruns']} overruns, jitter (ms) {stats['jitter_ms']}"
+        )
+        for name, phase in stats["phases_ms"].items():
+            log.info(
+                f"  {name:<10} mean {phase['mean']:6.2f} ms, "
+                f"max {phase['max']:6.2f} ms"
+            )
@@ -17,7 +17,8 @@ DEFAULT_SETTINGS = {
     "kiosk_clock_position": 2,
     "servo_safety": False,
     "servo_safety_timeout": 900,
-    "servo_safety_clock_position": 2
+    "servo_safety_clock_position": 2,
+    "spi_speed_hz": None,  # None is hat.DEFAULT_SPI_SPEED_HZ, see spi_selftest.py
 }
 
 def get_settings(settings_file="bot.json"):
@@ -0,0 +1,269 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+A simulated Moab (plate kinematics, a rolling ball and a camera) behind the
+same interface as MoabHardware, for running controllers without a bot
+"""
+
+import cv2
+import math
+import inspect
+import numpy as np
+import logging as log
+
+from hsv import hue_to_bgr
+from fakespi import FakeSpiDev
+from common import Vector2
+from hardware import MoabHardware, _untimed, plate_angles_to_servo_positions
+from profiler import LatencyProfiler
+from hat import Hat, SendCommand
+from detector import hsv_detector, pixel_to_meter_ratio
+
+PLATE_RADIUS = 0.225 / 2  # meters
+BALL_RADIUS = 0.02  # A ping pong ball
+GRAVITY = 9.81
+# A ball rolling down a slope accelerates at g * sin(angle) / (1 + I / (m r^2)),
+# with I = 2/3 m r^2 for a thin shell like a ping pong ball
+ROLLING_ACCELERATION = GRAVITY / (1 + 2 / 3)
+
+# Options of MoabHardware (camera, stream, SPI...) and their defaults
+_HARDWARE_OPTIONS = {
+    name: p.default
+    for name, p in inspect.signature(MoabHardware.__init__).parameters.items()
+    if p.default is not inspect.Parameter.empty
+}
+
+
+def servo_positions_to_plate_angles(
+    servos,
+    arm_len: float = 55.0,
+    side_len: float = 170.87,
+):
+    """
+    The plate pitch and roll (degrees) the three servo positions put it at. The
+    inverse of hardware.plate_angles_to_servo_positions (before its clipping).
+    """
+    z1, z2, z3 = (2 * arm_len * math.sin(math.radians(180 - s)) for s in servos)
+    r = (z2 + z3) / 2
+
+    sin_pitch = (z3 - z2) / side_len
+    sin_roll = (z1 - r) / (side_len * math.sqrt(3) / 2)
+    pitch = math.degrees(math.asin(min(max(sin_pitch, -1.0), 1.0)))
+    roll = math.degrees(math.asin(min(max(sin_roll, -1.0), 1.0)))
+    return pitch, roll
+
+
+class SimulatedCamera:
+    """Renders the simulated ball onto the plate as a 256x256 BGR frame."""
+
+    def __init__(self, sim, frame_size=256):
+        self.sim = sim
+        self.frame_size = frame_size
+        self.frame = np.zeros((frame_size, frame_size, 3), dtype=np.uint8)
+        self.pixels_per_meter = 1 / pixel_to_meter_ratio(frame_size)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def __call__(self):
+        d = self.frame_size
+        scale = self.pixels_per_meter
+        self.frame[:] = 40  # Dark background around the plate
+        cv2.circle(
+            self.frame,
+            (d // 2, d // 2),
+            int(PLATE_RADIUS * scale),
+            (200, 200, 200),
+            -1,
+        )
+
+        if self.sim.ball_on_plate:
+            # The detector rotates the camera frame by -30 degrees, undo that
+            x, y = Vector2(*self.sim.ball).rotate(math.radians(30))
+            center = (int(d // 2 + x * scale), int(d // 2 + y * scale))
+            color = hue_to_bgr(self.sim.hue, s=1.0, v=1.0)
+            radius = int(BALL_RADIUS * scale)
+            cv2.circle(self.frame, center, radius, color, -1, cv2.LINE_AA)
+
+        return self.frame, 1 / self.sim.frequency
+
+
+class SimulatedHardware(MoabHardware):
+    """
+    A drop in for MoabHardware that simulates the bot instead of driving one.
+
+    Servo commands still go through a Hat (over a fakespi.FakeSpiDev emulating
+    the firmware, so displays and buttons work as usual). The servos follow
+    their setpoints with a first order lag, the plate angles come from the
+    servo positions, and a ball rolls on the plate until it falls off the edge.
+
+    Time only advances in step(), by one frame, so a simulation runs as fast as
+    it can be computed. With render=True each step draws a camera frame and
+    runs the real ball detector on it; otherwise the ball position is returned
+    directly, with `noise` meters of gaussian noise.
+
+    The simulated bot is built perfectly, the calibration's servo offsets are
+    taken out again.
+    """
+
+    def __init__(
+        self,
+        frequency=30,
+        debug=False,
+        verbose=0,
+        calibration_file="bot.json",
+        tracking_detector=False,
+        localization="circle",
+        profile=False,
+        render=False,
+        noise=0.0005,
+        servo_time_constant=0.05,  # seconds
+        rolling_damping=0.1,  # 1/s, rolling resistance and air drag
+        substeps=4,
+        dropped_frames=0.0,  # Chance the camera skips a frame
+        missed_detections=0.0,  # Chance the ball isn't found in a frame
+        seed=None,
+        **kwargs,  # Options of the real hardware, no effect here
+    ):
+        # Accepted so MoabEnv can pass its options either way, but say so when
+        # one is set to something the simulation doesn't do
+        for name, value in kwargs.items():
+            if name not in _HARDWARE_OPTIONS:
+                raise TypeError(f"SimulatedHardware got an unknown option {name!r}")
+            if value != _HARDWARE_OPTIONS[name]:
+                log.warning(f"SimulatedHardware ignores {name}={value!r}")
+
+        self.debug = debug
+        self.verbose = verbose
+        self.frequency = frequency
+        self.calibration_file = calibration_file
+        self.render = render
+        self.noise = noise
+        self.servo_time_constant = servo_time_constant
+        self.rolling_damping = rolling_damping
+        self.substeps = substeps
+        self.dropped_frames = dropped_frames
+        self.missed_detections = missed_detections
+        self.rng = np.random.default_rng(seed)
+
+        # No pacing needed, the fake bus is instant
+        no_gaps = {command: 0.0 for command in SendCommand}
+        self.hat = Hat(
+            debug=debug, verbose=verbose, spi=FakeSpiDev(), message_gaps=no_gaps
+        )
+        self.hat.open()
+        self.camera = SimulatedCamera(self)
+        self.publisher = None
+        self.detector = hsv_detector(
+            debug=debug, tracking=tracking_detector, localization=localization
+        )
+
+        # Set the calibration
+        self.reset_calibration()
+
+        self.phase = _untimed
+        self.profiler = None
+        if profile:
+            self.profiler = LatencyProfiler()
+            self.phase = self.profiler.phase
+            self.hat.profiler = self.profiler
+
+        self.time = 0.0
+        self.elapsed_time = 1 / frequency
+        self.servos = list(plate_angles_to_servo_positions(0, 0))  # Level
+        self.pitch, self.roll = 0.0, 0.0
+        self.reset_ball()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.hat.close()
+
+    def go_up(self):
+        self.set_servos(150, 150, 150)
+
+    def go_down(self):
+        self.set_servos(155, 155, 155)
+
+    def reset_ball(self, position=None, velocity=(0.0, 0.0)):
+        """
+        Put the ball back on the plate, at `position` (meters from the center)
+        or somewhere random within the inner half of the plate.
+        """
+        if position is None:
+            r = PLATE_RADIUS / 2 * math.sqrt(self.rng.random())
+            theta = 2 * math.pi * self.rng.random()
+            position = (r * math.cos(theta), r * math.sin(theta))
+
+        self.ball = list(position)
+        self.ball_vel = list(velocity)
+        self.ball_on_plate = True
+
+    def simulate(self, duration: float):
+        """Advance the servos, plate and ball by `duration` seconds."""
+        dt = duration / self.substeps
+        alpha = 1 - math.exp(-dt / self.servo_time_constant)
+        setpoints = [
+            s - offset for s, offset in zip(self.hat.spi.servos, self.servo_offsets)
+        ]
+        if not self.hat.spi.servos_enabled:
+            setpoints = self.servos  # Unpowered servos stay where they are
+
+        for _ in range(self.substeps):
+            self.servos = [s + alpha * (t - s) for s, t in zip(self.servos, setpoints)]
+            self.pitch, self.roll = servo_positions_to_plate_angles(self.servos)
+            if not self.ball_on_plate:
+                continue
+
+            # Semi-implicit Euler: update the velocity first, then the position
+            ax = -ROLLING_ACCELERATION * math.sin(math.radians(self.pitch))
+            ay = -ROLLING_ACCELERATION * math.sin(math.radians(self.roll))
+            vx, vy = self.ball_vel
+            vx += (ax - self.rolling_damping * vx) * dt
+            vy += (ay - self.rolling_damping * vy) * dt
+            self.ball_vel = [vx, vy]
+            self.ball = [self.ball[0] + vx * dt, self.ball[1] + vy * dt]
+
+            if math.hypot(*self.ball) > PLATE_RADIUS:
+                self.ball_on_plate = False
+
+        self.time += duration
+
+    def step(self, pitch, roll):
+        with self.phase("spi"):
+            self.set_angles(pitch, roll)
+        # A dropped frame means the next one comes a frame period later
+        self.elapsed_time = 1 / self.frequency
+        while self.dropped_frames and self.rng.random() < self.dropped_frames:
+            self.elapsed_time += 1 / self.frequency
+        with self.phase("physics"):
+            self.simulate(self.elapsed_time)
+
+        if self.render:
+            with self.phase("camera"):
+                frame, elapsed_time = self.camera()
+            with self.phase("detect"):
+                ball_detected, (ball_center, ball_radius) = self.detector(
+                    frame, hue=self.hue
+                )
+        else:
+            ball_detected = self.ball_on_plate
+            ball_center = Vector2(0, 0)
+            if ball_detected:
+                x, y = self.ball + self.rng.normal(0.0, self.noise, 2)
+                ball_center = Vector2(x, y)
+
+        if ball_detected and self.missed_detections:
+            if self.rng.random() < self.missed_detections:
+                ball_detected, ball_center = False, Vector2(0, 0)
+
+        buttons = self.hat.get_buttons()
+        if self.profiler is not None:
+            self.profiler.maybe_log()
+
+        return ball_center, ball_detected, buttons
@@ -0,0 +1,47 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Run the hat's SPI self-test (Hat.autotune_spi_speed) and save the fastest
+reliable clock rate to bot.json, where MoabHardware picks it up:
+
+    python3 spi_selftest.py --max-speed 1000000
+
+Stop the menu first (sudo systemctl stop menu), it holds the SPI bus.
+"""
+
+import argparse
+import logging as log
+
+from settings import update_setting
+from hat import Hat, DEFAULT_SPI_SPEED_HZ, SPI_SPEEDS_HZ
+
+
+def tune_spi_speed(hat, max_speed_hz, calibration_file="bot.json", trials=20):
+    """Self-test `hat` up to max_speed_hz and save the rate it picked."""
+    speed = hat.autotune_spi_speed(trials=trials, max_speed_hz=max_speed_hz)
+    update_setting("spi_speed_hz", speed, calibration_file)
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--max-speed",
+        type=int,
+        choices=SPI_SPEEDS_HZ,
+        default=DEFAULT_SPI_SPEED_HZ,
+        help="Fastest clock rate (Hz) to try",
+    )
+    parser.add_argument("--trials", type=int, default=20, help="NOOPs per rate")
+    parser.add_argument("-f", "--file", default="bot.json", help="Settings file")
+    args = parser.parse_args()
+
+    log.basicConfig(level=log.INFO)
+    with Hat() as hat:
+        speed = tune_spi_speed(hat, args.max_speed, args.file, args.trials)
+    print(f"Saved spi_speed_hz = {speed} to {args.file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import cv2
+import time
+from base_camera import BaseCamera
+from frame_ring import FrameRing
+
+
+class CameraSharedMemory(BaseCamera):
+
+    @staticmethod
+    def frames():
+        ring = FrameRing.open()
+        seq = 0
+
+        try:
+            while True:
+                # Let the control loop know a viewer is connected; it only
+                # copies frames into the ring while the heartbeat is fresh.
+                # This generator stops when the last viewer goes away.
+                ring.heartbeat()
+
+                seq, frame = ring.read(seq)
+                if frame is None:
+                    time.sleep(0.005)
+                    continue
+
+                yield cv2.imencode(".jpg", frame)[1].tobytes()
+        finally:
+            ring.close()
@@ -0,0 +1,126 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Shared memory ring of raw frames between the control loop (writer) and the
+stream service (reader).
+
+Layout of the segment (all header fields are uint64):
+    header     MAGIC, slots, height, width, channels, seq, heartbeat, unused
+    slot_seqs  sequence number of the frame held in each slot (0 = being written)
+    frames     slots * height * width * channels bytes
+
+The writer puts frame `seq` into slot `seq % slots`, then publishes `seq` in the
+header. Readers check the slot sequence number before and after copying so a
+frame that was overwritten mid-copy is never handed out (torn read).
+"""
+
+import time
+import numpy as np
+
+from multiprocessing import shared_memory, resource_tracker
+
+SHM_NAME = "moab_frames"
+MAGIC = 0x4D4F4142  # "MOAB"
+
+# Header field indices
+_MAGIC, _SLOTS, _HEIGHT, _WIDTH, _CHANNELS, _SEQ, _HEARTBEAT = range(7)
+_HEADER_LEN = 8
+
+
+class FrameRing:
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.header = np.ndarray((_HEADER_LEN,), dtype=np.uint64, buffer=shm.buf)
+
+        # Wait for the creator to finish writing the header
+        deadline = time.monotonic() + 1.0
+        while self.header[_MAGIC] != MAGIC:
+            if time.monotonic() > deadline:
+                raise IOError(f"Shared memory `{shm.name}` is not a frame ring")
+            time.sleep(0.001)
+
+        slots = int(self.header[_SLOTS])
+        self.shape = tuple(int(n) for n in self.header[_HEIGHT : _CHANNELS + 1])
+        offset = self.header.nbytes
+        self.slot_seqs = np.ndarray(
+            (slots,), dtype=np.uint64, buffer=shm.buf, offset=offset
+        )
+        offset += self.slot_seqs.nbytes
+        self.frames = np.ndarray(
+            (slots, *self.shape), dtype=np.uint8, buffer=shm.buf, offset=offset
+        )
+
+    @classmethod
+    def open(cls, name=SHM_NAME, shape=(256, 256, 3), slots=3):
+        """
+        Attach to the ring `name`, creating it if it doesn't exist yet. Either
+        side may start first; `shape` and `slots` only apply when creating.
+        """
+        size = (_HEADER_LEN + slots) * 8 + slots * int(np.prod(shape))
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            header = np.ndarray((_HEADER_LEN,), dtype=np.uint64, buffer=shm.buf)
+            header[:] = 0
+            header[_SLOTS] = slots
+            header[_HEIGHT : _CHANNELS + 1] = shape
+            header[_MAGIC] = MAGIC  # Last, marks the header as complete
+            del header
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name=name)
+
+        # The ring outlives both processes (it's reused across restarts), so
+        # stop the resource tracker from unlinking it when this process exits.
+        # The tracker has the POSIX name, with the "/" that shm.name leaves out.
+        resource_tracker.unregister("/" + shm.name, "shared_memory")
+        return cls(shm)
+
+    def close(self):
+        # Drop the numpy views first, the buffer can't be released while
+        # they are still alive
+        del self.header, self.slot_seqs, self.frames
+        self.shm.close()
+
+    def write(self, img) -> int:
+        """Copy `img` into the next slot and publish it. Returns its seq."""
+        seq = int(self.header[_SEQ]) + 1
+        slot = seq % len(self.slot_seqs)
+
+        self.slot_seqs[slot] = 0  # Mark the slot as being written
+        self.frames[slot] = img
+        self.slot_seqs[slot] = seq
+        self.header[_SEQ] = seq
+        return seq
+
+    def read(self, last_seq=0, out=None):
+        """
+        Copy out the newest frame if it's newer than `last_seq`.
+        Returns (seq, frame), or (last_seq, None) if there is nothing new.
+        """
+        for _ in range(3):
+            seq = int(self.header[_SEQ])
+            if seq == last_seq:
+                break
+
+            slot = seq % len(self.slot_seqs)
+            if self.slot_seqs[slot] != seq:
+                continue  # Writer has already moved on to this slot, retry
+
+            if out is None:
+                frame = self.frames[slot].copy()
+            else:
+                frame = out
+                np.copyto(out, self.frames[slot])
+
+            if self.slot_seqs[slot] == seq:
+                return seq, frame
+
+        return last_seq, None
+
+    def heartbeat(self):
+        """Called by readers to let the writer know someone is watching."""
+        self.header[_HEARTBEAT] = time.monotonic_ns()
+
+    def viewer_active(self, timeout=5.0) -> bool:
+        last_heartbeat = int(self.header[_HEARTBEAT])
+        return time.monotonic_ns() - last_heartbeat < timeout * 1e9
@@ -6,6 +6,7 @@ import logging
 from flask import Flask, render_template, Response, url_for, redirect
 from camera_file import CameraFile
 from camera_opencv import CameraOpenCV
+from camera_shm import CameraSharedMemory
 
 app = Flask(__name__, static_url_path='', static_folder='static', template_folder='static')
 
@@ -30,6 +31,11 @@ def video_mjpeg():
     return Response(gen(CameraFile()),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/shm_mjpeg')
+def shm_mjpeg():
+    return Response(gen(CameraSharedMemory()),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
 @app.route('/opencv_mjpeg')
 def opencv_mjpeg():
     return Response(gen(CameraOpenCV()),
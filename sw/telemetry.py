@@ -0,0 +1,272 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Control loop telemetry, recorded into memory and written out in binary
+
+    python3 telemetry.py /tmp/log.bin [/tmp/log.csv | /tmp/log.parquet]
+
+converts a log to the columns log_csv.py writes.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+import numpy as np
+
+from collections import deque
+
+TELEMETRY_DTYPE = np.dtype(
+    [
+        ("tick", "<i8"),
+        ("time_ns", "<i8"),  # time.monotonic_ns()
+        ("dt", "<f8"),  # Seconds since the previous tick
+        ("x", "<f8"),
+        ("y", "<f8"),
+        ("vel_x", "<f8"),
+        ("vel_y", "<f8"),
+        ("sum_x", "<f8"),
+        ("sum_y", "<f8"),
+        ("detected", "u1"),
+        ("pitch", "<f8"),
+        ("roll", "<f8"),
+        ("status", "<i2"),
+    ]
+)
+
+# Columns of the converted log, as log_csv.py writes them
+CSV_COLUMNS = ["tick", "dt", "x", "y", "vel_x", "vel_y", "distance"]
+CSV_COLUMNS += ["pitch", "roll", "status", "error_response"]
+
+_loggers = {}  # The logger of each file, flushed at exit
+
+
+class TelemetryLogger:
+    """
+    Records a row (TELEMETRY_DTYPE) per control tick into a preallocated ring,
+    which is a single structured array write. A writer thread appends the rows
+    to `filename` in blocks, every `interval` seconds, and stops when nothing
+    has been recorded for `idle_timeout` seconds (record() starts it again).
+
+    Responses have no fixed width, so they are kept separately and written as
+    json lines to `filename` + ".resp": those of ticks with an error status
+    (>= 400), or of every tick with `responses=True` (ie the brain's reply,
+    as log_csv.py kept).
+
+    If the writer falls more than `capacity` ticks behind, the oldest ones are
+    lost (and counted in `dropped`).
+
+    There is one logger per file: a new one closes the previous logger of its
+    file before starting the log, so no stale rows are appended to it.
+    """
+
+    def __init__(
+        self,
+        filename,
+        capacity=4096,
+        interval=1.0,
+        idle_timeout=2.0,
+        responses=False,
+    ):
+        self.filename = filename
+        self.capacity = capacity
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.rows = np.zeros(capacity, dtype=TELEMETRY_DTYPE)
+        self.responses = responses
+        self.resp = deque()  # (tick, response), appended by the control thread
+        self.count = 0  # Ticks recorded so far
+        self.saved = 0  # Ticks written to the file
+        self.dropped = 0
+        self.lock = threading.Lock()  # Serializes flushes
+        self.thread = None
+        self.closed = threading.Event()
+
+        key = os.path.abspath(filename)
+        if key in _loggers:
+            _loggers[key].close()
+
+        # Start a new log
+        open(filename, "wb").close()
+        open(f"{filename}.resp", "w").close()
+        _loggers[key] = self
+
+    def record(self, dt, env_state, ball_detected, action, status=200, resp=None):
+        tick = self.count
+        x, y, vel_x, vel_y, sum_x, sum_y = env_state
+        pitch, roll = action
+        self.rows[tick % self.capacity] = (
+            tick,
+            time.monotonic_ns(),
+            dt,
+            x,
+            y,
+            vel_x,
+            vel_y,
+            sum_x,
+            sum_y,
+            ball_detected,
+            pitch,
+            roll,
+            status,
+        )
+        if status >= 400 or self.responses:
+            self.resp.append((tick, resp))
+        self.count = tick + 1
+
+        if self.thread is None and not self.closed.is_set():
+            self.thread = threading.Thread(target=self._writer, daemon=True)
+            self.thread.start()
+
+    def flush(self):
+        """Write everything recorded since the last flush."""
+        with self.lock:
+            start, stop = self.saved, self.count
+            if stop == start and not self.resp:
+                return
+            if stop - start > self.capacity:
+                self.dropped += stop - start - self.capacity
+                start = stop - self.capacity
+
+            ticks = np.arange(start, stop)
+            rows = self.rows[ticks % self.capacity]
+            # Leave out any overwritten while we were reading them
+            rows = rows[rows["tick"] == ticks]
+            with open(self.filename, "ab") as f:
+                f.write(rows.tobytes())
+            self.saved = stop
+
+            if self.resp:
+                with open(f"{self.filename}.resp", "a") as f:
+                    # Only takes what was there, the control thread may append
+                    for _ in range(len(self.resp)):
+                        tick, resp = self.resp.popleft()
+                        print(json.dumps([tick, str(resp)]), file=f)
+
+    def close(self):
+        """Stop the writer and write what it hadn't, nothing is written after."""
+        self.closed.set()
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _writer(self):
+        idle = 0.0
+        while idle < self.idle_timeout:
+            if self.closed.wait(self.interval):
+                break
+            recorded = self.count != self.saved
+            self.flush()
+            idle = 0.0 if recorded else idle + self.interval
+        self.thread = None
+        if self.count != self.saved:
+            self.flush()  # Recorded while we were stopping
+
+
+@atexit.register
+def _flush_loggers():
+    for logger in list(_loggers.values()):
+        logger.flush()
+
+
+def telemetry_decorator(fn, logfile="/tmp/log.bin", **kwargs):
+    """
+    Log the state, action and status of every tick of a controller, like
+    log_csv.log_decorator but to a TelemetryLogger (convert with main()).
+    """
+    logger = TelemetryLogger(logfile, **kwargs)
+    prev_time = time.time()
+
+    # Acts like a normal controller function
+    def decorated_fn(state):
+        nonlocal prev_time
+        now = time.time()
+        dt, prev_time = now - prev_time, now
+
+        # Run the actual controller
+        action, info = fn(state)
+
+        env_state, ball_detected, buttons = state
+        status = info.get("status") or 200
+        resp = info.get("resp") or ""
+        logger.record(dt, env_state, ball_detected, action, status, resp)
+        return action, info
+
+    return decorated_fn
+
+
+def load_telemetry(filename):
+    """
+    The rows of a log (as TELEMETRY_DTYPE) and a dict of tick -> response of
+    the ticks whose response was kept.
+    """
+    rows = np.fromfile(filename, dtype=TELEMETRY_DTYPE)
+    responses = {}
+    if os.path.exists(f"{filename}.resp"):
+        with open(f"{filename}.resp") as f:
+            for line in f:
+                tick, resp = json.loads(line)
+                responses[tick] = resp
+    return rows, responses
+
+
+def to_columns(rows, responses):
+    """The CSV_COLUMNS of a log, as a dict of column name -> values."""
+    return {
+        "tick": rows["tick"],
+        "dt": rows["dt"],
+        "x": rows["x"],
+        "y": rows["y"],
+        "vel_x": rows["vel_x"],
+        "vel_y": rows["vel_y"],
+        "distance": np.hypot(rows["x"], rows["y"]),
+        "pitch": rows["pitch"],
+        "roll": rows["roll"],
+        "status": rows["status"],
+        "error_response": [responses.get(int(tick), "") for tick in rows["tick"]],
+    }
+
+
+def write_csv(columns, filename):
+    with open(filename, "w") as f:
+        print(",".join(CSV_COLUMNS), file=f)
+        for values in zip(*(columns[name] for name in CSV_COLUMNS)):
+            *numbers, resp = values
+            # Formatted like log_csv.py: floats to 5 digits, quoted response
+            fields = [
+                f"{n:8.5f}" if isinstance(n, np.floating) else str(n) for n in numbers
+            ]
+            print(",".join(fields + [f'"{resp}"']), file=f)
+
+
+def write_parquet(columns, filename):
+    # Imported here, menu.py loads this module on every start
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError(f"pandas (and pyarrow) is needed to write {filename}")
+    pandas.DataFrame(columns).to_parquet(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a telemetry log")
+    parser.add_argument("log", help="Telemetry log, ie /tmp/log.bin")
+    parser.add_argument("output", nargs="?", help=".csv (default) or .parquet")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.log)[0] + ".csv"
+    columns = to_columns(*load_telemetry(args.log))
+    if output.endswith(".parquet"):
+        write_parquet(columns, output)
+    else:
+        write_csv(columns, output)
+    print(f"Wrote {len(columns['tick'])} ticks to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# Time brain_controller predictions against a stand-in v2 brain served from
+# this process: a new connection per request (the old requests.post), the
+# kept-open HttpTransport, and the UnixSocketTransport. Then run a 30 Hz loop on
+# a slow brain, with brain_controller and with async_brain_controller.
+#
+#   python3 tests/brain_bench.py
+
+import os
+import json
+import time
+import tempfile
+import requests
+import threading
+import socketserver
+import numpy as np
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import parent
+from env import EnvState
+from controllers import brain_controller, async_brain_controller
+from controllers import HttpTransport, UnixSocketTransport
+
+iterations = 2000
+frequency = 30
+ticks = 5 * frequency
+client_id = 123
+state = (EnvState(0.01, -0.02, 0.1, 0.05), True, None)
+
+
+class Brain(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    inference_time = 0.0  # Seconds
+
+    def reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_DELETE(self):
+        self.reply(204)
+
+    def do_POST(self):
+        json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.inference_time)
+        action = {"input_pitch": 0.25, "input_roll": -0.5}
+        self.reply(200, {"concepts": {"Balance": {"action": action}}})
+
+    def log_message(self, *args):
+        pass
+
+
+class V1Brain(Brain):
+    def do_DELETE(self):
+        self.send_error(404)  # An html error page
+
+    def do_GET(self):
+        self.reply(200, {"input_pitch": 0.25, "input_roll": -0.5})
+
+
+class TcpBrain(Brain):
+    # Like uvicorn & co, or the kept-open connection waits on delayed ACKs
+    disable_nagle_algorithm = True
+
+
+class SlowBrain(TcpBrain):
+    # Mostly a frame behind, sometimes a lot more
+    def do_POST(self):
+        self.inference_time = np.random.choice((0.04, 0.15), p=(0.9, 0.1))
+        super().do_POST()
+
+
+class UnixBrainServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("localhost", 0)  # BaseHTTPRequestHandler wants a host
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def old_predict(port):
+    # What brain_controller did before: module level requests.post
+    url = f"http://localhost:{port}/v2/clients/{client_id}/predict"
+    observables = {"state": {"ball_x": 0.01, "ball_y": -0.02}}
+
+    def predict():
+        response = requests.post(url, json=observables)
+        return response.status_code, response.json()
+
+    return predict
+
+
+def measure(name, predict):
+    latency = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        predict()
+        latency.append((time.perf_counter() - start) * 1e3)
+    p50, p99 = np.percentile(latency, (50, 99))
+    print(f"{name:<28} p50 {p50:6.3f} ms, p99 {p99:6.3f} ms")
+
+
+def control_loop(name, controller):
+    # Tick at `frequency`, the time left after the controller is slept away
+    periods, staleness, fallbacks = [], [], 0
+    next_tick = last = time.monotonic()
+    for _ in range(ticks):
+        action, info = controller(state)
+        if info.get("fallback"):
+            fallbacks += 1
+        else:
+            # A blocking controller's action is as old as the call took
+            age_ms = (time.monotonic() - last) * 1e3
+            staleness.append(info.get("staleness_ms", age_ms))
+        next_tick = max(next_tick + 1 / frequency, time.monotonic())
+        time.sleep(max(0, next_tick - time.monotonic()))
+        now = time.monotonic()
+        periods.append((now - last) * 1e3)
+        last = now
+
+    p50, p99 = np.percentile(periods, (50, 99))
+    print(
+        f"{name:<28} tick p50 {p50:6.2f} ms, p99 {p99:6.2f} ms, "
+        f"{fallbacks} fallbacks ({fallbacks / ticks:4.0%}), "
+        f"staleness p50 {np.median(staleness):5.1f} ms"
+    )
+
+
+def main():
+    tcp = serve(ThreadingHTTPServer(("localhost", 0), TcpBrain))
+    port = tcp.server_address[1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "brain.sock")
+        serve(UnixBrainServer(socket_path, Brain))
+
+        measure("requests.post (old)", old_predict(port))
+
+        controller = brain_controller(transport=HttpTransport(port))
+        measure("HttpTransport", lambda: controller(state))
+
+        controller = brain_controller(transport=UnixSocketTransport(socket_path))
+        measure("UnixSocketTransport", lambda: controller(state))
+
+        action, info = controller(state)
+        print(f"Action {tuple(action)}, info {info}")
+        print(f"Predict p50/p95/p99 (ms): {controller.latency.summary()}")
+
+    v1 = serve(ThreadingHTTPServer(("localhost", 0), V1Brain))
+    action, info = brain_controller(port=v1.server_address[1])(state)
+    print(f"v1 brain: action {tuple(action)}, status {info['status']}")
+
+    slow = serve(ThreadingHTTPServer(("localhost", 0), SlowBrain))
+    port = slow.server_address[1]
+    control_loop("Slow brain, brain_controller", brain_controller(port=port))
+    control_loop("async_brain_controller", async_brain_controller(port=port))
+    for max_staleness in (0.1, 0.15, 0.3):
+        control_loop(
+            f"  max_staleness={max_staleness}",
+            async_brain_controller(max_staleness=max_staleness, port=port),
+        )
+
+
+if __name__ == "__main__":
+    main()
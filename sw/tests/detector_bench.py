@@ -0,0 +1,66 @@
+# Compare the ball localization modes of hsv_detector on synthetic 256x256
+# frames: an anti-aliased ball at known sub-pixel positions with camera noise.
+#
+#   python3 tests/detector_bench.py
+
+import cv2
+import time
+import numpy as np
+
+import parent
+from common import Vector2
+from hsv import hue_to_bgr
+from detector import hsv_detector, pixels_to_meters
+
+d = 256
+hue = 44
+ball_radius = 26  # Pixels
+frames = 500
+shift = 4  # Sub-pixel bits for cv2.circle
+
+
+def synthetic_frame(rng, center, noise):
+    img = np.full((d, d, 3), 200, dtype=np.uint8)  # Plate
+    c = tuple(int(round(v * (1 << shift))) for v in center)
+    color = hue_to_bgr(hue, s=1.0, v=1.0)
+    cv2.circle(img, c, ball_radius << shift, color, -1, cv2.LINE_AA, shift)
+    img = img + rng.normal(0.0, noise, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def expected_center(center):
+    # Where the detector should report `center`, in meters
+    x, y = center[0] - d // 2, center[1] - d // 2
+    return pixels_to_meters(Vector2(x, y).rotate(np.radians(-30)))
+
+
+def measure(localization, noise, rng):
+    detector = hsv_detector(hue=hue, localization=localization)
+    errors, elapsed = [], 0.0
+    for _ in range(frames):
+        center = rng.uniform(80, 176, 2)
+        img = synthetic_frame(rng, center, noise)
+        start = time.perf_counter()
+        detected, (found, _) = detector(img)
+        elapsed += time.perf_counter() - start
+        if detected:
+            errors.append(np.hypot(*(found - expected_center(center))))
+
+    # Back to pixels to compare with the quantization of the old mode
+    errors = np.array(errors) / pixels_to_meters(1.0)
+    rms = np.sqrt(np.mean(errors**2))
+    print(
+        f"noise {noise:4.0f}, {localization:<8} detected {len(errors)}/{frames}, "
+        f"error rms {rms:5.3f} px, p99 {np.percentile(errors, 99):5.3f} px, "
+        f"{elapsed / frames * 1e3:6.3f} ms/frame"
+    )
+
+
+def main():
+    for noise in (5.0, 20.0, 35.0):  # Gaussian noise per channel
+        for localization in ("circle", "moments"):
+            measure(localization, noise, np.random.default_rng(0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Check docker.BrainCache against a stand-in Docker API served on a unix
+# socket from this process, and time a full listing against a refresh.
+#
+#   python3 tests/docker_bench.py
+#
+# On moab, compare with `docker ps` (what build_menu ran on every refresh):
+#   python3 tests/docker_bench.py --real
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import socketserver
+
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler
+
+import parent
+import docker
+
+iterations = 200
+
+
+def container(name, image, port, network="bridge"):
+    return {
+        "Names": [f"/{name}"],
+        "Image": image,
+        "Ports": [
+            {"IP": "::", "PrivatePort": 5000, "PublicPort": port, "Type": "tcp"},
+            {"IP": "0.0.0.0", "PrivatePort": 5000, "PublicPort": port, "Type": "tcp"},
+        ],
+        "NetworkSettings": {"Networks": {network: {}}},
+    }
+
+
+class Docker:
+    def __init__(self):
+        self.containers = [
+            container("circle", "example.azurecr.io/abc/circle:2-linux-arm32v7", 5001),
+            container("moab-brain", "moab/brain:3", 5000),
+        ]
+        self.events = []  # (time, container name)
+        self.lists = 0
+
+    def start(self, name, image, port):
+        self.containers.append(container(name, image, port))
+        self.events.append((time.time(), name))
+
+
+class DockerAPI(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/containers/json":
+            self.server.docker.lists += 1
+            body = json.dumps(self.server.docker.containers)
+        elif url.path == "/events":
+            since, until = float(query["since"][0]), float(query["until"][0])
+            body = "".join(
+                json.dumps({"Type": "container", "Actor": {"ID": name}}) + "\n"
+                for t, name in self.server.docker.events
+                if since <= t <= until
+            )
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class DockerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("localhost", 0)  # BaseHTTPRequestHandler wants a host
+
+
+def time_ms(fn, number=iterations):
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number * 1e3
+
+
+def main():
+    if "--real" in sys.argv:
+        print(f"docker ps:         {time_ms(docker.ps, 10):8.3f} ms")
+        cache = docker.BrainCache(cache_file="/tmp/brains_bench.json")
+        print(f"BrainCache, full:  {time_ms(lambda: cache(full=True), 10):8.3f} ms")
+        print(f"BrainCache:        {time_ms(cache):8.3f} ms")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "docker.sock")
+        cache_file = os.path.join(tmp, "brains.json")
+        server = DockerServer(socket_path, DockerAPI)
+        server.docker = Docker()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        cache = docker.BrainCache(socket_path, cache_file)
+        print("Brains:", [(b.short_name, b.port) for b in cache()])
+
+        full_ms = time_ms(lambda: cache(full=True))
+        lists = server.docker.lists
+        refresh_ms = time_ms(cache)
+        print(f"Full listing: {full_ms:6.3f} ms, refresh: {refresh_ms:6.3f} ms")
+        print(f"Listings during the refreshes: {server.docker.lists - lists}")
+
+        server.docker.start("square", "moab/square:1", 5002)
+        print("After a start:", [(b.short_name, b.port) for b in cache()])
+
+        lists = server.docker.lists
+        restarted = docker.BrainCache(socket_path, cache_file)
+        brains = restarted()
+        print(
+            f"From the cache file: {len(brains)} brains, "
+            f"{server.docker.lists - lists} listings"
+        )
+
+        # One anyone could have written is ignored
+        os.chmod(cache_file, 0o666)
+        untrusted = docker.BrainCache(socket_path, cache_file)
+        print(f"World writable cache file used: {untrusted.brains is not None}")
+
+
+if __name__ == "__main__":
+    main()
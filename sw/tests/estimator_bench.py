@@ -0,0 +1,78 @@
+# Compare the state estimators on the simulated bot under the PID controller:
+# the error of the estimated velocity against the simulated ball's, with clean
+# frames, dropped camera frames and missed detections.
+#
+#   python3 tests/estimator_bench.py
+
+import os
+import time
+import tempfile
+import numpy as np
+
+import parent
+from env import MoabEnv
+from controllers import pid_controller
+from common import derivative_estimator, KalmanEstimator
+
+frequency = 30
+episodes = 20
+episode_steps = 10 * frequency  # 10 s of simulated time
+
+estimators = {"derivative": derivative_estimator, "kalman": KalmanEstimator}
+conditions = {
+    "clean": {},
+    "10% frames dropped": {"dropped_frames": 0.1},
+    "10% detections missed": {"missed_detections": 0.1},
+}
+
+
+def run(estimator_fn, calibration_file, **sim_kwargs):
+    errors = []
+    balanced = 0
+    elapsed = 0.0
+    with MoabEnv(
+        frequency,
+        calibration_file=calibration_file,
+        estimator_fn=estimator_fn,
+        simulate=True,
+        seed=0,
+        **sim_kwargs,
+    ) as env:
+        env.hardware.enable_servos()
+        controller = pid_controller()
+        for _ in range(episodes):
+            env.hardware.reset_ball()
+            state = env.reset()
+            for _ in range(episode_steps):
+                action, info = controller(state)
+                start = time.perf_counter()
+                state = env.step(action)
+                elapsed += time.perf_counter() - start
+                if not env.hardware.ball_on_plate:
+                    break
+                env_state, ball_detected, buttons = state
+                estimate = (env_state.vel_x, env_state.vel_y)
+                errors.append(np.hypot(*np.subtract(estimate, env.hardware.ball_vel)))
+            else:
+                balanced += 1
+
+    errors = np.array(errors)
+    return (
+        f"velocity error rms {np.sqrt(np.mean(errors ** 2)):6.4f} m/s, "
+        f"max {errors.max():6.3f} m/s, balanced {balanced}/{episodes}, "
+        f"{elapsed / len(errors) * 1e6:5.0f} us/step"
+    )
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        calibration_file = os.path.join(tmp, "bot.json")
+        for condition, sim_kwargs in conditions.items():
+            print(condition)
+            for name, estimator_fn in estimators.items():
+                result = run(estimator_fn, calibration_file, **sim_kwargs)
+                print(f"  {name:<10} {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Per-frame cost of encoding a servo packet and decoding the reply: the old
+# pad()/np.int16 path against the preallocated struct encoder in hat.py. The
+# SPI bus is replaced by a loopback so only the Python side is measured.
+#
+# To run on moab:
+#   python3 tests/hat_packet_bench.py
+
+import timeit
+import numpy as np
+
+import parent
+from hat import Hat, Buttons, SendCommand
+
+iterations = 20000
+servos = (150.5, 120.0, 130.25)
+reply = [0, 1, 0xF6, 100, 0, 0, 0, 0]  # joy button pressed, x=-0.1, y=1.0
+
+
+class Loopback:
+    def xfer(self, packet):
+        return reply
+
+
+def pad(*args, **kwargs):
+    # hat.py's old helper: an exact 8 byte numpy array
+    data = [*args][:8]
+    pads = (8 - len(data)) * [0]
+    dtype = kwargs.pop("dtype", np.int8)
+    return np.array(data + pads, dtype)
+
+
+def old_frame(buttons):
+    # What Hat.set_servos + transceive used to do
+    s1, s2, s3 = (np.int16(s * 100) for s in servos)
+    packet = pad(
+        SendCommand.SET_SERVOS,
+        s3 >> 8,
+        s3 & 0x00FF,
+        s1 >> 8,
+        s1 & 0x00FF,
+        s2 >> 8,
+        s2 & 0x00FF,
+    )
+    hat_to_pi = Loopback().xfer(packet.tolist())
+    buttons.menu_button = hat_to_pi[0] == 1
+    buttons.joy_button = hat_to_pi[1] == 1
+    buttons.joy_x = np.int8(hat_to_pi[2]) / 100
+    buttons.joy_y = np.int8(hat_to_pi[3]) / 100
+    return packet
+
+
+def main():
+    # No pacing between frames, measure the encoding only
+    hat = Hat(message_gaps={SendCommand.SET_SERVOS: 0.0})
+    hat.spi = Loopback()
+
+    # Both paths must put the same bytes on the wire and decode the same reply
+    old_buttons = Buttons()
+    old_packet = [b & 0xFF for b in old_frame(old_buttons).tolist()]
+    hat.set_servos(servos)
+    print(f"Same packet: {old_packet == list(hat.tx)}")
+    print(f"Same buttons: {old_buttons == hat.get_buttons()}")
+
+    old_us = timeit.timeit(lambda: old_frame(old_buttons), number=iterations)
+    new_us = timeit.timeit(lambda: hat.set_servos(servos), number=iterations)
+    old_us = old_us / iterations * 1e6
+    new_us = new_us / iterations * 1e6
+
+    print(f"pad + np.int16: {old_us:6.2f} us/frame")
+    print(f"struct encoder: {new_us:6.2f} us/frame")
+    print(f"Speedup:        {old_us / new_us:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Compare the 3-channel hue_mask + cv2.inRange path with the single channel
+# hue_mask_gray kernel on 256x256 frames.
+#
+# To run on moab (after `make install` in sw/huemask):
+#   python3 tests/huemask_bench.py
+
+import cv2
+import timeit
+import numpy as np
+
+import parent
+from huemask import hue_mask, hue_mask_gray
+
+d = 256
+hue = 44
+iterations = 500
+
+
+def synthetic_frame(seed=0):
+    # Noisy background with an orange ball roughly in the middle
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 255, (d, d, 3), dtype=np.uint8)
+    cv2.circle(img, (140, 110), 30, (0, 128, 255), -1)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+
+def old_path(img_hsv):
+    img = img_hsv.copy()  # hue_mask overwrites its input
+    hue_mask(img, hue / 2, 0.03, 60.0, 1.5)
+    return cv2.inRange(img, np.array((200, 200, 200)), np.array((255, 255, 255)))
+
+
+def new_path(img_hsv, out):
+    return hue_mask_gray(img_hsv, hue / 2, 0.03, 60.0, 1.5, 200, out)
+
+
+def main():
+    img_hsv = synthetic_frame()
+    out = np.empty((d, d), dtype=np.uint8)
+
+    # Both paths must produce the same b&w mask
+    old_mask = old_path(img_hsv)
+    new_mask = new_path(img_hsv, out)
+    mismatched = np.count_nonzero(old_mask != new_mask)
+    print(f"Mismatched pixels: {mismatched} of {d * d}")
+
+    copy_ms = timeit.timeit(img_hsv.copy, number=iterations) / iterations * 1e3
+    old_ms = timeit.timeit(lambda: old_path(img_hsv), number=iterations)
+    old_ms = old_ms / iterations * 1e3 - copy_ms
+    new_ms = timeit.timeit(lambda: new_path(img_hsv, out), number=iterations)
+    new_ms = new_ms / iterations * 1e3
+
+    print(f"hue_mask + inRange: {old_ms:6.3f} ms/frame")
+    print(f"hue_mask_gray:      {new_ms:6.3f} ms/frame")
+    print(f"Speedup:            {old_ms / new_ms:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
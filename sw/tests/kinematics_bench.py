@@ -0,0 +1,125 @@
+# Check the scalar (math) and batched (numpy) plate inverse kinematics against
+# the original numpy implementation, and time them. Also checks the calibrated
+# ServoTransform words against the packet set_angles used to build.
+#
+#   python3 tests/kinematics_bench.py
+
+import timeit
+import numpy as np
+
+import parent
+from fakespi import FakeSpiDev
+from hat import Hat, SendCommand
+from hardware import (
+    ServoTransform,
+    plate_angles_to_servo_positions,
+    plate_angles_to_servo_positions_batch,
+)
+
+iterations = 20000
+servo_offsets = (-1.25, 0.5, 2.75)
+
+
+def reference(
+    pitch,
+    roll,
+    arm_len=55.0,
+    side_len=170.87,
+    pivot_height=80.0,
+    angle_max=160,
+    angle_min=90,
+):
+    # The original implementation
+    servo_angles = [0.0, 0.0, 0.0]
+
+    z1 = pivot_height + np.sin(np.radians(roll)) * (side_len / np.sqrt(3))
+    r = pivot_height - np.sin(np.radians(roll)) * (side_len / (2 * np.sqrt(3)))
+    z2 = r + np.sin(np.radians(-pitch)) * (side_len / 2)
+    z3 = r - np.sin(np.radians(-pitch)) * (side_len / 2)
+
+    if z1 > 2 * arm_len:
+        z1 = 2 * arm_len
+    if z2 > 2 * arm_len:
+        z2 = 2 * arm_len
+    if z3 > 2 * arm_len:
+        z3 = 2 * arm_len
+
+    servo_angles[0] = 180 - (np.degrees(np.arcsin(z1 / (2 * arm_len))))
+    servo_angles[1] = 180 - (np.degrees(np.arcsin(z2 / (2 * arm_len))))
+    servo_angles[2] = 180 - (np.degrees(np.arcsin(z3 / (2 * arm_len))))
+
+    servo_angles = np.clip(servo_angles, angle_min, angle_max)
+    return servo_angles
+
+
+def set_angles_reference(hat, pitch, roll):
+    # set_angles before ServoTransform: kinematics, offsets, then set_servos
+    s1, s2, s3 = plate_angles_to_servo_positions(pitch, roll)
+    o1, o2, o3 = servo_offsets
+    hat.set_servos((s1 + o1, s2 + o2, s3 + o3))
+
+
+def servo_transform(pitch, roll):
+    hat = Hat(spi=FakeSpiDev(), message_gaps={SendCommand.SET_SERVOS: 0.0})
+    hat.open()
+    transform = ServoTransform(servo_offsets)
+
+    mismatched = 0
+    for p, r in zip(pitch, roll):
+        set_angles_reference(hat, p, r)
+        expected = bytes(hat.tx)
+        hat.set_servo_words(transform.words(p, r))
+        mismatched += bytes(hat.tx) != expected
+    print(f"Packets differing from set_servos: {mismatched} of {len(pitch)}")
+
+    batch = transform.batch(pitch, roll)
+    scalar = np.array([transform.servo_positions(p, r) for p, r in zip(pitch, roll)])
+    print(f"Max difference, transform batch: {np.abs(batch - scalar).max():.2e}")
+
+    old_us = timeit.timeit(
+        lambda: set_angles_reference(hat, 12.5, -7.25), number=iterations
+    )
+    new_us = timeit.timeit(
+        lambda: hat.set_servo_words(transform.words(12.5, -7.25)),
+        number=iterations,
+    )
+    old_us = old_us / iterations * 1e6
+    new_us = new_us / iterations * 1e6
+    hat.close()
+    print(f"set_angles, old:         {old_us:7.3f} us/call")
+    print(f"set_angles, transform:   {new_us:7.3f} us/call ({old_us / new_us:.1f}x)")
+
+
+def main():
+    # Past the ±22° envelope too, so the clipping is covered
+    angles = np.linspace(-40, 40, 161)
+    pitch, roll = (a.ravel() for a in np.meshgrid(angles, angles))
+
+    expected = np.array([reference(p, r) for p, r in zip(pitch, roll)])
+    scalar = np.array(
+        [plate_angles_to_servo_positions(p, r) for p, r in zip(pitch, roll)]
+    )
+    batch = plate_angles_to_servo_positions_batch(pitch, roll)
+    print(f"Max difference, scalar: {np.abs(scalar - expected).max():.2e} degrees")
+    print(f"Max difference, batch:  {np.abs(batch - expected).max():.2e} degrees")
+
+    old_us = timeit.timeit(lambda: reference(12.5, -7.25), number=iterations)
+    new_us = timeit.timeit(
+        lambda: plate_angles_to_servo_positions(12.5, -7.25), number=iterations
+    )
+    batch_us = timeit.timeit(
+        lambda: plate_angles_to_servo_positions_batch(pitch, roll), number=100
+    )
+    old_us = old_us / iterations * 1e6
+    new_us = new_us / iterations * 1e6
+    batch_us = batch_us / 100 / len(pitch) * 1e6
+
+    print(f"numpy scalar (old): {old_us:7.3f} us/call")
+    print(f"math scalar:        {new_us:7.3f} us/call ({old_us / new_us:.1f}x)")
+    print(f"batch:              {batch_us:7.3f} us/sample ({old_us / batch_us:.0f}x)")
+
+    servo_transform(pitch, roll)
+
+
+if __name__ == "__main__":
+    main()
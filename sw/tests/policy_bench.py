@@ -0,0 +1,74 @@
+# Check policy_controller against a plain NumPy evaluation of the same network
+# (with next_action_v1's scaling, clipping & rounding), and time it per tick.
+# Also runs an .onnx policy if one is given (needs onnxruntime).
+#
+#   python3 tests/policy_bench.py [policy.onnx]
+
+import os
+import sys
+import timeit
+import tempfile
+import numpy as np
+
+import parent
+from env import EnvState
+from controllers import policy_controller
+
+iterations = 20000
+hidden = (64, 64)
+
+
+def random_policy(filename, rng):
+    sizes = (4, *hidden, 2)
+    layers = {}
+    for n, (inputs, outputs) in enumerate(zip(sizes[:-1], sizes[1:])):
+        layers[f"weights_{n}"] = rng.normal(0, 1 / np.sqrt(inputs), (inputs, outputs))
+        layers[f"bias_{n}"] = rng.normal(0, 0.1, outputs)
+    obs_std = np.array((0.05, 0.05, 0.5, 0.5))
+    np.savez(filename, obs_std=obs_std, **layers)
+    return layers, obs_std
+
+
+def reference_action(layers, obs_std, observation, max_angle=22):
+    x = np.asarray(observation) / obs_std
+    for n in range(len(hidden) + 1):
+        x = np.tanh(x @ layers[f"weights_{n}"] + layers[f"bias_{n}"])
+    pitch, roll = x
+
+    # As in next_action_v1
+    pitch = np.clip(pitch * max_angle, -max_angle, max_angle)
+    roll = np.clip(roll * max_angle, -max_angle, max_angle)
+    pitch, roll = int(pitch), int(roll)
+    return -roll, pitch
+
+
+def time_controller(name, controller):
+    state = (EnvState(0.01, -0.02, 0.1, 0.05), True, None)
+    elapsed = timeit.timeit(lambda: controller(state), number=iterations)
+    print(f"{name:<14} {elapsed / iterations * 1e6:7.2f} us/tick")
+
+
+def main():
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "policy.npz")
+        layers, obs_std = random_policy(filename, rng)
+        controller = policy_controller(filename)
+
+        mismatched = 0
+        observations = rng.normal(0, (0.05, 0.05, 0.5, 0.5), (2000, 4))
+        for observation in observations:
+            state = (EnvState(*observation), True, None)
+            action, info = controller(state)
+            expected = reference_action(layers, obs_std, observation)
+            mismatched += tuple(action) != expected
+        print(f"Actions differing from the reference: {mismatched} of 2000")
+
+        time_controller("NumpyPolicy", controller)
+
+    if len(sys.argv) > 1:
+        time_controller("OnnxPolicy", policy_controller(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Run the PID controller (with CSV logging) against the simulated bot, as fast
+# as it can go, to benchmark the control stack without a bot.
+#
+#   python3 tests/sim_bench.py [episodes]
+
+import sys
+import time
+import tempfile
+
+import parent
+from env import MoabEnv
+from log_csv import log_decorator
+from controllers import pid_controller
+
+frequency = 30
+episode_steps = 10 * frequency  # 10 s of simulated time
+
+
+def run(episodes, render, logfile, calibration_file):
+    balanced = 0
+    steps = 0
+    start = time.perf_counter()
+    with MoabEnv(
+        frequency,
+        calibration_file=calibration_file,
+        simulate=True,
+        render=render,
+        seed=0,
+    ) as env:
+        env.hardware.enable_servos()
+        controller = log_decorator(pid_controller(), logfile)
+        for _ in range(episodes):
+            env.hardware.reset_ball()
+            state = env.reset()
+            for _ in range(episode_steps):
+                action, info = controller(state)
+                state = env.step(action)
+                steps += 1
+                if not env.hardware.ball_on_plate:
+                    break
+            else:
+                balanced += 1
+
+        elapsed = time.perf_counter() - start
+        stats = env.scheduler.stats()["phases_ms"]
+
+    mode = "rendered + detector" if render else "direct"
+    print(f"{mode}:")
+    print(
+        f"  {steps / elapsed:8.0f} steps/sec ({steps / elapsed / frequency:.0f}x real time)"
+    )
+    print(
+        f"  {episodes / elapsed * 60:8.0f} episodes/minute, {balanced}/{episodes} balanced"
+    )
+    for name, phase in stats.items():
+        print(f"  {name:<10} mean {phase['mean']:6.3f} ms")
+
+
+def main():
+    episodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        logfile = f"{tmp}/log.csv"
+        calibration_file = f"{tmp}/bot.json"
+        run(episodes, False, logfile, calibration_file)
+        run(episodes, True, logfile, calibration_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# Performance regression checks for the SPI layer, runnable on any Linux box:
+# the hat is emulated by fakespi.FakeSpiDev. FakeSpiDev has no fileno(), so
+# display updates take transceive_batch's one-transceive-per-frame fallback,
+# not the batched spidev ioctl used on moab.
+#
+#   python3 tests/spi_bench.py               # frames/sec, bytes per display
+#                                            # update, servo latency, replay,
+#                                            # SPI self-test saved to bot.json
+#   python3 tests/spi_bench.py trace.bin     # replay a trace recorded on moab
+#                                            # (menu.py --trace trace.bin)
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+import parent
+from fakespi import FakeSpiDev
+from hexyl import load_trace
+from settings import get_settings
+from spi_selftest import tune_spi_speed
+from hat import Hat, AsyncHat, Icon, SendCommand, SPI_SPEEDS_HZ
+
+frequency = 30
+duration = 3.0  # Seconds of control loop for the latency test
+servos = (150.0, 140.0, 130.0)
+long_text = "BALL DETECTED. PRESS THE MENU BUTTON TO GO BACK. " * 2
+
+
+def frames_per_second(iterations=20000):
+    # Software ceiling: no pacing between frames and an instant bus
+    hat = Hat(spi=FakeSpiDev(), message_gaps={SendCommand.SET_SERVOS: 0.0})
+    hat.open()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        hat.set_servos(servos)
+    elapsed = time.perf_counter() - start
+    hat.close()
+    print(f"Frames/sec (set_servos, no pacing): {iterations / elapsed:10.0f}")
+
+
+def bytes_per_display_update():
+    spi = FakeSpiDev()
+    hat = Hat(spi=spi)
+    hat.open()
+
+    print("Display updates, fallback path (one transceive per frame):")
+    updates = [
+        ("display_string", lambda: hat.display_string("HELLO")),
+        ("display_string (same)", lambda: hat.display_string("HELLO")),
+        ("display_string_icon", lambda: hat.display_string_icon("MENU", Icon.DOT)),
+        ("update_icon", lambda: hat.update_icon(Icon.UP)),
+        ("display_long_string", lambda: hat.display_long_string(long_text)),
+    ]
+    for name, update in updates:
+        frames = spi.frames
+        start = time.perf_counter()
+        update()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        sent = 8 * (spi.frames - frames)
+        print(f"Bytes per {name:<22} {sent:4d} in {elapsed_ms:6.2f} ms")
+    hat.close()
+
+
+def servo_latency(hat_class):
+    # Every tick uploads a new long screen then sets the servos. Latency is
+    # from the start of the tick until the setpoint is on the (emulated) bus.
+    spi = FakeSpiDev(realtime=True)
+    hat = hat_class(spi=spi)
+    hat.open()
+    if hat_class is AsyncHat:
+        hat.start()
+
+    sent = {}
+    ticks = int(duration * frequency)
+    for tick in range(ticks):
+        start = time.monotonic()
+        hat.display_long_string(f"{tick:05d} {long_text}")
+        setpoint = (servos[0], servos[1], 30 + tick)  # Tag the tick
+        hat.set_servos(setpoint)
+        sent[setpoint] = start
+        time.sleep(max(0, start + 1 / frequency - time.monotonic()))
+    hat.close()
+
+    latency_ms = [
+        (t - sent[setpoint]) * 1000
+        for t, setpoint in spi.servo_times
+        if setpoint in sent
+    ]
+    p50, p99 = np.percentile(latency_ms, (50, 99))
+    print(
+        f"Servo latency under UI load ({hat_class.__name__:<8}) "
+        f"p50 {p50:6.2f} ms, p99 {p99:6.2f} ms, max {max(latency_ms):6.2f} ms, "
+        f"{ticks - len(latency_ms)} setpoints superseded"
+    )
+    if hat_class is AsyncHat:
+        # A setpoint only waits for the frame on the bus (and its gap)
+        period_ms = 1000 / frequency
+        assert p99 < period_ms / 4, f"setpoint p99 {p99:.2f} ms of {period_ms:.1f}"
+
+
+def session(hat, spi):
+    # A short scripted session with some joystick input
+    hat.display_string_icon("MENU", Icon.UP_DOWN)
+    hat.enable_servos()
+    buttons = []
+    for i in range(50):
+        spi.joy_x, spi.joy_y = i - 25, 25 - i
+        spi.joy_button = i % 10 == 0
+        hat.set_servos((servos[0], servos[1], 120 + i / 10))
+        buttons.append(tuple(hat.get_buttons()))
+    hat.disable_servos()
+    return buttons
+
+
+def record_and_replay():
+    with tempfile.NamedTemporaryFile(suffix=".bin") as trace_file:
+        spi = FakeSpiDev()
+        hat = Hat(spi=spi, trace_file=trace_file.name)
+        hat.open()
+        recorded = session(hat, spi)
+        hat.close()
+
+        trace = load_trace(trace_file.name)
+        spi = FakeSpiDev(trace)
+        hat = Hat(spi=spi)
+        hat.open()
+        replayed = session(hat, FakeSpiDev())  # Input now comes from the trace
+        hat.close()
+
+    print(
+        f"Replayed {spi.replayed} of {len(trace)} frames, "
+        f"{spi.mismatches} mismatched, "
+        f"same buttons: {recorded == replayed}"
+    )
+
+
+class GarbledAbove(FakeSpiDev):
+    # A hat whose replies come back garbled above `limit_hz`
+    def __init__(self, limit_hz):
+        super().__init__()
+        self.limit_hz = limit_hz
+
+    def xfer(self, values):
+        rx = super().xfer(values)
+        return [0xFF] * 8 if self.max_speed_hz > self.limit_hz else rx
+
+
+def selftest_saves_speed():
+    # The fastest clean rate up to the maximum asked for ends up in bot.json
+    cases = [
+        (FakeSpiDev(), max(SPI_SPEEDS_HZ), max(SPI_SPEEDS_HZ)),
+        (FakeSpiDev(), 500000, 500000),
+        (GarbledAbove(250000), max(SPI_SPEEDS_HZ), 250000),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for spi, max_speed_hz, expected in cases:
+            calibration_file = os.path.join(tmp, "bot.json")
+            hat = Hat(spi=spi)
+            hat.open()
+            hat.display_string("")  # Blank already, the clear must still be sent
+            frames = spi.frames - spi.frames_by_command[SendCommand.NOOP]
+            speed = tune_spi_speed(hat, max_speed_hz, calibration_file)
+            cleared = spi.frames - spi.frames_by_command[SendCommand.NOOP] > frames
+            hat.close()
+            saved = get_settings(calibration_file)["spi_speed_hz"]
+            assert speed == saved == expected, (speed, saved, expected)
+            assert cleared, "the self-test didn't clear the hat's string buffer"
+            print(f"SPI self-test up to {max_speed_hz:7d} Hz saved {saved:7d} Hz")
+
+
+def replay(filename):
+    # Summarize the session and send its frames through Hat again, unpaced
+    trace = load_trace(filename)
+    spi = FakeSpiDev(trace)
+    hat = Hat(spi=spi, message_gaps={command: 0.0 for command in SendCommand})
+    hat.open()
+    start = time.perf_counter()
+    for record in trace:
+        hat.transceive(bytes(record["tx"]))
+    elapsed = time.perf_counter() - start
+    hat.close()
+
+    recorded_s = (trace["time_ns"][-1] - trace["time_ns"][0]) / 1e9
+    commands, counts = np.unique(trace["tx"][:, 0], return_counts=True)
+    print(f"{len(trace)} frames over {recorded_s:.1f} s recorded")
+    print(f"Frames by command: {dict(zip(map(hex, commands), counts.tolist()))}")
+    print(f"Replayed at {len(trace) / elapsed:.0f} frames/sec")
+
+
+def main():
+    if len(sys.argv) > 1:
+        replay(sys.argv[1])
+        return
+
+    frames_per_second()
+    bytes_per_display_update()
+    servo_latency(Hat)
+    servo_latency(AsyncHat)
+    record_and_replay()
+    selftest_saves_speed()
+
+
+if __name__ == "__main__":
+    main()
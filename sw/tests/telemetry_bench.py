@@ -0,0 +1,103 @@
+# Time a logged controller per tick, with log_csv.log_decorator (opens and
+# writes the CSV every tick) and telemetry.telemetry_decorator, and check the
+# converted telemetry against the CSV, and that a new run logging to the same
+# file only finds its own ticks in it.
+#
+#   python3 tests/telemetry_bench.py
+
+import os
+import time
+import tempfile
+import numpy as np
+
+import parent
+import telemetry
+from env import EnvState
+from log_csv import log_decorator
+
+iterations = 20000
+rng = np.random.default_rng(0)
+states = [
+    (EnvState(*rng.normal(0, (0.05, 0.05, 0.5, 0.5, 1, 1))), True, None)
+    for _ in range(iterations)
+]
+
+
+def controller(state):
+    env_state, ball_detected, buttons = state
+    if env_state.x > 0.1:
+        return (1.0, -2.0), {"status": 400, "resp": "Brain not found"}
+    return (env_state.x * 100, env_state.y * 100), {}
+
+
+def time_ticks(name, decorated):
+    latency = []
+    for state in states:
+        start = time.perf_counter()
+        decorated(state)
+        latency.append((time.perf_counter() - start) * 1e6)
+    p50, p99, worst = np.percentile(latency, (50, 99, 100))
+    print(f"{name:<20} p50 {p50:7.2f} us, p99 {p99:7.2f} us, max {worst:8.1f} us")
+
+
+def read_csv(filename):
+    with open(filename) as f:
+        header = f.readline().strip().split(",")
+        rows = [line.strip().split(",", len(header) - 1) for line in f]
+    return header, rows
+
+
+def runs_to_same_file(filename):
+    # The first run's writer still has its ticks pending when the second starts
+    first = telemetry.telemetry_decorator(controller, filename, interval=0.2)
+    for state in states[:100]:
+        first(state)
+    second = telemetry.telemetry_decorator(controller, filename, interval=0.2)
+    for state in states[:50]:
+        second(state)
+    time.sleep(0.5)  # Both writers would have had their turn
+    telemetry._flush_loggers()
+
+    rows, _ = telemetry.load_telemetry(filename)
+    assert list(rows["tick"]) == list(range(50)), rows["tick"]
+    print(f"Second run to the same file: {len(rows)} of its 50 ticks, no others")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "log.csv")
+        time_ticks("log_decorator", log_decorator(controller, csv_file))
+
+        bin_file = os.path.join(tmp, "log.bin")
+        # Enough room for all of them, it's much faster than the 30 Hz it's for
+        logged = telemetry.telemetry_decorator(
+            controller, bin_file, capacity=iterations
+        )
+        time_ticks("telemetry_decorator", logged)
+        telemetry._flush_loggers()
+
+        converted = os.path.join(tmp, "converted.csv")
+        columns = telemetry.to_columns(*telemetry.load_telemetry(bin_file))
+        telemetry.write_csv(columns, converted)
+
+        header, expected = read_csv(csv_file)
+        converted_header, rows = read_csv(converted)
+        assert header == converted_header, (header, converted_header)
+        differing = 0
+        for old, new in zip(expected, rows):
+            # dt is measured, so it differs between the runs
+            numbers = zip(old[2:-2], new[2:-2])
+            differing += any(abs(float(a) - float(b)) > 1e-5 for a, b in numbers) or (
+                old[0] != new[0] or old[-2:] != new[-2:]
+            )
+        print(f"Rows differing from log_decorator's: {differing} of {len(rows)}")
+        print(
+            f"Sizes: {os.path.getsize(csv_file)} bytes CSV, "
+            f"{os.path.getsize(bin_file)} bytes telemetry"
+        )
+
+        runs_to_same_file(os.path.join(tmp, "runs.bin"))
+
+
+if __name__ == "__main__":
+    main()
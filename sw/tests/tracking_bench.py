@@ -0,0 +1,74 @@
+# Time hsv_detector with and without tracking on synthetic frames of a ball
+# circling the plate (see detector_bench.py), check both find the same centers,
+# and count the frames lost when the ball is moved between runs with and
+# without reset_track (what MoabEnv.reset does).
+#
+#   python3 tests/tracking_bench.py
+
+import time
+import numpy as np
+
+import parent
+from detector import hsv_detector
+from detector_bench import synthetic_frame, hue
+
+frames = 300
+frequency = 30
+noise = 5.0
+
+
+def circling(n, radius=60, period=2.0):
+    t = np.arange(n) / frequency
+    angle = 2 * np.pi * t / period
+    return np.stack((128 + radius * np.cos(angle), 128 + radius * np.sin(angle)), 1)
+
+
+def measure(tracking, images):
+    detector = hsv_detector(hue=hue, tracking=tracking)
+    centers, elapsed = [], []
+    for img in images:
+        start = time.perf_counter()
+        detected, (center, _) = detector(img)
+        elapsed.append(time.perf_counter() - start)
+        centers.append(tuple(center) if detected else (np.nan, np.nan))
+    centers = np.array(centers)
+    ms = np.median(elapsed) * 1e3
+    detected = np.sum(~np.isnan(centers[:, 0]))
+    name = "tracking" if tracking else "full frame"
+    print(f"{name:<10} {ms:6.3f} ms/frame, detected {detected}/{len(images)}")
+    return centers, ms
+
+
+def moved_between_runs(reset, rng):
+    # Track the ball to the left, then a new run starts with it bottom right
+    detector = hsv_detector(hue=hue, tracking=True)
+    for center in circling(30):
+        detector(synthetic_frame(rng, center, noise))
+    if reset:
+        detector.reset_track()
+
+    missed = 0
+    for _ in range(10):
+        detected, _ = detector(synthetic_frame(rng, (190, 190), noise))
+        if detected:
+            break
+        missed += 1
+    return missed
+
+
+def main():
+    rng = np.random.default_rng(0)
+    images = [synthetic_frame(rng, c, noise) for c in circling(frames)]
+
+    full, full_ms = measure(False, images)
+    tracked, tracked_ms = measure(True, images)
+    print(f"Speedup: {full_ms / tracked_ms:.1f}x")
+    print(f"Max center difference: {np.nanmax(np.abs(full - tracked)):.2e} m")
+
+    for reset in (False, True):
+        missed = moved_between_runs(reset, np.random.default_rng(1))
+        print(f"Ball moved between runs, reset_track={reset}: {missed} frames lost")
+
+
+if __name__ == "__main__":
+    main()